@@ -2,59 +2,135 @@
 # Verifique "LICENSE" para mais informações sobre redistribuição e uso do Software.
 # Copyright (c) 2025 Lusomedia™
 # Este software está sob a licença Lusomedia™ License 1.0. Veja "LICENSE" para mais informações.
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify, g
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import sqlite3
-from datetime import datetime
+from datetime import datetime, timezone
 import os
+import sys
 import json
+import bz2
+import gzip
+import click
+import hashlib
+import math
+from contextlib import contextmanager
+from collections import deque, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeoutError, wait, FIRST_COMPLETED
+import bisect
+import difflib
+from functools import lru_cache
+import shutil
+import tempfile
+import xml.etree.ElementTree as ET
+from xml.sax.saxutils import XMLGenerator
+import threading
+import time
 import requests
-import random
 import re
 import uuid
 import bleach
-from markupsafe import escape
+from markupsafe import escape, Markup
+from jinja2 import FileSystemBytecodeCache, Undefined, nodes
+from jinja2.ext import Extension
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits.storage import Storage, SlidingWindowCounterSupport
 from flask_wtf.csrf import CSRFProtect
 
-limiter = Limiter(
-    app,
-    key_func=get_remote_address,
-    default_limits=["60 per minute"]
-)
+try:
+    import zstandard
+except ImportError:  # compressão zstd é opcional
+    zstandard = None
+
+try:
+    import psycopg
+    from psycopg.rows import dict_row
+    from psycopg_pool import ConnectionPool
+except ImportError:  # PostgreSQL é opcional; o padrão é SQLite
+    psycopg = None
 
 CONFIG_PATH = "config.json"
+CONFIG_CHECK_INTERVAL = 2  # segundos entre checagens de mtime do config.json
+
+DEFAULT_CONFIG = {
+    "APP_TITLE": "EXAMPLE",
+    "LICENSE": "EXAMPLE",
+    "DB_FILE": "EXAMPLE.db"
+}
 
 # Carrega config do arquivo ou cria default
 def load_config():
     if not os.path.exists(CONFIG_PATH):
-        config = {
-            "APP_TITLE": "EXAMPLE",
-            "LICENSE": "EXAMPLE",
-            "DB_FILE": "EXAMPLE.db"
-        }
-        return config
+        return dict(DEFAULT_CONFIG)
 
     with open(CONFIG_PATH, "r", encoding="utf-8") as f:
         try:
             config = json.load(f)
-        except:            
-            APP_TITLE = EXAMPLE
-            LICENSE = EXAMPLE
-            DB_FILE = EXAMPLE.db
-        return config
+        except ValueError:
+            return dict(DEFAULT_CONFIG)
+        return {**DEFAULT_CONFIG, **config}
 
 def save_config(config):
-    with open(CONFIG_PATH, "w", encoding="utf-8") as f:
+    # escreve num temporário e troca de uma vez, assim outro worker nunca lê arquivo pela metade
+    tmp_path = f"{CONFIG_PATH}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
         json.dump(config, f, indent=4, ensure_ascii=False)
+    os.replace(tmp_path, CONFIG_PATH)
+
+class WikiConfig:
+    """Config compartilhada entre workers.
+
+    O config.json é a fonte da verdade; cada worker guarda uma cópia em memória
+    versionada pelo mtime do arquivo e só recarrega quando ele muda. O stat é
+    feito no máximo uma vez a cada CONFIG_CHECK_INTERVAL segundos.
+    """
+
+    def __init__(self, path, check_interval=CONFIG_CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.data = dict(DEFAULT_CONFIG)
+        self.exists = False
+        self.version = None  # st_mtime_ns do arquivo carregado
+        self.next_check = 0.0
+        self.reload()
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
+    def _stat_version(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        """Relê o arquivo. Retorna True se o DB_FILE mudou."""
+        with self.lock:
+            old_db = self.data.get("DB_FILE")
+            self.version = self._stat_version()
+            self.exists = self.version is not None
+            self.data = load_config()
+            self.next_check = time.monotonic() + self.check_interval
+            return self.data.get("DB_FILE") != old_db
+
+    def refresh(self):
+        """Recarrega se o arquivo mudou desde a última leitura (checagem barata e espaçada)."""
+        now = time.monotonic()
+        if now < self.next_check:
+            return False
+        self.next_check = now + self.check_interval
+        if self._stat_version() == self.version:
+            return False
+        return self.reload()
 
 # --- Inicializa config ---
-config = load_config()
-APP_TITLE = config.get("APP_TITLE")
-LICENSE = config.get("LICENSE")
-DB_FILE = config.get("DB_FILE")
+wiki_config = WikiConfig(CONFIG_PATH)
 
 UPLOAD_FOLDER = "static/uploads"
 
@@ -71,12 +147,181 @@ def allowed_file(filename):
 
 app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # 64MB
 
+# ---------- RATE LIMIT ----------
+# contadores num sqlite próprio (fora do DB da wiki), compartilhado por todos os
+# workers da máquina; o limits acha a classe pelo esquema "sqlite://" da URI
+RATELIMIT_STORAGE_URI = wiki_config.get("RATELIMIT_STORAGE_URI", "sqlite:///ratelimit.db")
+RATELIMIT_CLEANUP_EVERY = 1000  # incrementos entre limpezas de chaves expiradas
+
+class SQLiteRateLimitStorage(Storage, SlidingWindowCounterSupport):
+    """Storage do flask-limiter num arquivo sqlite local.
+
+    Cada contador é uma linha (key, count, expires); incr é um único UPSERT
+    atômico e o sliding window roda dentro de BEGIN IMMEDIATE, então vários
+    processos contam juntos sem corrida. Conexões são por thread e por pid
+    (não atravessam o fork do gunicorn).
+    """
+
+    STORAGE_SCHEME = ["sqlite"]
+
+    def __init__(self, uri=None, wrap_exceptions=False, **options):
+        super().__init__(uri, wrap_exceptions=wrap_exceptions, **options)
+        self.path = uri.split("://", 1)[1].lstrip("/") if uri and "://" in uri else "ratelimit.db"
+        if uri and uri.startswith("sqlite:////"):
+            self.path = "/" + self.path
+        self.local = threading.local()
+        self.incr_count = 0
+        with self._transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS ratelimit (
+                    key TEXT PRIMARY KEY,
+                    count INTEGER NOT NULL,
+                    expires REAL NOT NULL
+                ) WITHOUT ROWID
+            """)
+
+    @property
+    def base_exceptions(self):
+        return sqlite3.Error
+
+    def _conn(self):
+        if getattr(self.local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=OFF")  # perder contador num crash não importa
+            self.local.conn = conn
+            self.local.pid = os.getpid()
+        return self.local.conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    def _incr(self, conn, key, expiry, amount, now):
+        # janela expirada recomeça do zero, igual ao storage em memória
+        return conn.execute("""
+            INSERT INTO ratelimit (key, count, expires) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                count = CASE WHEN expires <= ? THEN excluded.count ELSE count + excluded.count END,
+                expires = CASE WHEN expires <= ? THEN excluded.expires ELSE expires END
+            RETURNING count
+        """, (key, amount, now + expiry, now, now)).fetchone()[0]
+
+    def _sweep(self, conn, now):
+        # roda nos dois caminhos de escrita (incr e sliding window); sem isso as
+        # chaves key/<janela> de janelas velhas ficam no arquivo pra sempre
+        self.incr_count += 1
+        if self.incr_count % RATELIMIT_CLEANUP_EVERY == 0:
+            conn.execute("DELETE FROM ratelimit WHERE expires <= ?", (now,))
+
+    def _get(self, conn, key, now):
+        row = conn.execute("SELECT count FROM ratelimit WHERE key=? AND expires > ?", (key, now)).fetchone()
+        return row[0] if row else 0
+
+    def incr(self, key, expiry, amount=1):
+        now = time.time()
+        conn = self._conn()
+        self._sweep(conn, now)
+        return self._incr(conn, key, expiry, amount, now)
+
+    def decr(self, key, amount=1):
+        self._conn().execute("UPDATE ratelimit SET count = MAX(count - ?, 0) WHERE key=?", (amount, key))
+
+    def get(self, key):
+        return self._get(self._conn(), key, time.time())
+
+    def get_expiry(self, key):
+        now = time.time()
+        row = self._conn().execute("SELECT expires FROM ratelimit WHERE key=? AND expires > ?", (key, now)).fetchone()
+        return row[0] if row else now
+
+    def check(self):
+        try:
+            self._conn().execute("SELECT 1")
+            return True
+        except sqlite3.Error:
+            return False
+
+    def reset(self):
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM ratelimit").rowcount
+
+    def clear(self, key):
+        self._conn().execute("DELETE FROM ratelimit WHERE key=?", (key,))
+
+    @staticmethod
+    def sliding_window_keys(key, expiry, now):
+        # chave da janela anterior e da atual, pelo número da janela
+        return f"{key}/{int((now - expiry) / expiry)}", f"{key}/{int(now / expiry)}"
+
+    def _window_info(self, conn, previous_key, current_key, expiry, now):
+        previous_count = self._get(conn, previous_key, now)
+        current_count = self._get(conn, current_key, now)
+        previous_ttl = 0.0 if previous_count == 0 else (1 - (((now - expiry) / expiry) % 1)) * expiry
+        current_ttl = (1 - ((now / expiry) % 1)) * expiry + expiry
+        return previous_count, previous_ttl, current_count, current_ttl
+
+    def acquire_sliding_window_entry(self, key, limit, expiry, amount=1):
+        if amount > limit:
+            return False
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        with self._transaction() as conn:
+            previous_count, previous_ttl, current_count, _ = self._window_info(conn, previous_key, current_key, expiry, now)
+            if math.floor(previous_count * previous_ttl / expiry + current_count) + amount > limit:
+                return False
+            self._sweep(conn, now)
+            self._incr(conn, current_key, 2 * expiry, amount, now)
+            return True
+
+    def get_sliding_window(self, key, expiry):
+        now = time.time()
+        previous_key, current_key = self.sliding_window_keys(key, expiry, now)
+        return self._window_info(self._conn(), previous_key, current_key, expiry, now)
+
+    def clear_sliding_window(self, key, expiry):
+        previous_key, current_key = self.sliding_window_keys(key, expiry, time.time())
+        self.clear(previous_key)
+        self.clear(current_key)
+
+limiter = Limiter(
+    get_remote_address,
+    app=app,
+    default_limits=["60 per minute"],
+    storage_uri=RATELIMIT_STORAGE_URI,
+    strategy="sliding-window-counter"
+)
+
+@limiter.request_filter
+def skip_static_limits():
+    # arquivos estáticos e uploads não contam pro limite nem tocam o storage
+    return request.endpoint in ("static", "uploaded_file")
+
 app.config.update(
     SESSION_COOKIE_SECURE=True,   # só HTTPS
     SESSION_COOKIE_HTTPONLY=True, # JS não consegue ler
     SESSION_COOKIE_SAMESITE='Lax' # previne CSRF básico
 )
 
+# ---------- CONFIG POR REQUEST ----------
+@app.before_request
+def refresh_config():
+    # se outro worker trocou o DB_FILE, este também precisa garantir o schema
+    if wiki_config.refresh():
+        repo.init_schema()
+
+@app.context_processor
+def inject_config():
+    return {"APP_TITLE": wiki_config["APP_TITLE"], "LICENSE": wiki_config["LICENSE"]}
+
 # ---------- JINJA FILTER ----------
 @app.template_filter('fmt_dt')
 def fmt_dt(value):
@@ -88,10 +333,102 @@ def fmt_dt(value):
     except Exception:
         return value
 
+@app.template_filter('fmt_delta')
+def fmt_delta(value):
+    # estilo MediaWiki: (+123) verde, (-45) vermelho
+    if value is None:
+        return ""
+    color = "#006400" if value > 0 else "#8b0000" if value < 0 else "#72777d"
+    return Markup('<span class="size-delta" style="color:%s;">(%s)</span>') % (color, f"{value:+d}")
+
+# ---------- TEMPLATE CACHE ----------
+# bytecode dos templates fica em disco e sobrevive a restart dos workers;
+# fragmentos renderizados ficam num LRU em memória por worker
+TEMPLATE_CACHE_FOLDER = "cache/jinja"
+FRAGMENT_CACHE_SIZE = 512
+
+os.makedirs(TEMPLATE_CACHE_FOLDER, exist_ok=True)
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache(TEMPLATE_CACHE_FOLDER)
+
+class FragmentCache:
+    """LRU de fragmentos de HTML por chave (tupla).
+
+    As chaves levam a versão do dado (ex.: ts da última discussão), então um
+    worker nunca serve fragmento velho mesmo sem ver a invalidação de outro;
+    invalidate() só libera a memória das versões antigas.
+    """
+
+    def __init__(self, max_entries=FRAGMENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            html = self.entries.get(key)
+            if html is not None:
+                self.entries.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        with self.lock:
+            self.entries[key] = html
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def pin(self, key):
+        """Guarda o fragmento pro request atual; True se ele estava em cache.
+
+        A rota usa isso pra pular as queries do bloco, e o pin garante que o
+        template ache o fragmento mesmo se o LRU descartar no meio do caminho.
+        """
+        html = self.get(key)
+        if html is None:
+            return False
+        g.setdefault("pinned_fragments", {})[key] = html
+        return True
+
+    def invalidate(self, *prefix):
+        with self.lock:
+            for key in [k for k in self.entries if k[:len(prefix)] == prefix]:
+                del self.entries[key]
+
+fragment_cache = FragmentCache()
+
+class FragmentCacheExtension(Extension):
+    """{% cache "nome", parte1, parte2 %}...{% endcache %}
+
+    Partes None ou indefinidas desligam o cache do bloco (ex.: página sem artigo).
+    """
+
+    tags = {"cache"}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        parts = [parser.parse_expression()]
+        while parser.stream.skip_if("comma"):
+            parts.append(parser.parse_expression())
+        body = parser.parse_statements(("name:endcache",), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method("_render_cached", [nodes.Tuple(parts, "load")]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key, caller):
+        if any(part is None or isinstance(part, Undefined) for part in key):
+            return caller()
+        html = g.get("pinned_fragments", {}).get(key) or fragment_cache.get(key)
+        if html is None:
+            html = caller()
+            fragment_cache.set(key, html)
+        return html
+
+app.jinja_env.add_extension(FragmentCacheExtension)
+
 # ---------- DB ----------
 def get_db():
     conn = sqlite3.connect(
-        DB_FILE,
+        wiki_config["DB_FILE"],
         detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES,
         timeout=5,              # espera 5s se o banco estiver ocupado
         check_same_thread=False  # permite usar a conexão em threads diferentes
@@ -104,18 +441,65 @@ def get_db():
 def get_user():
     if 'username' not in session:
         return None
-    username = session['username']
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE username=?", (username,))
-    row = c.fetchone()
-    conn.close()
+    row = repo.get_user(session['username'])
     if row:
         return {'id': row['id'], 'username': row['username'], 'is_admin': row['is_admin']}
     return None
 
+def ensure_columns(c, table, columns):
+    existing = {row[1] for row in c.execute(f"PRAGMA table_info({table})")}
+    for name, decl in columns.items():
+        if name not in existing:
+            c.execute(f"ALTER TABLE {table} ADD COLUMN {name} {decl}")
+
+def backfill_article_ids(conn, batch_size=5000):
+    """Preenche article_history.article_id pelo slug, batch_size linhas por transação.
+
+    Revisões órfãs (slug sem artigo) continuam com NULL.
+    """
+    c = conn.cursor()
+    last_id = 0
+    done = 0
+    while True:
+        c.execute(
+            "SELECT MAX(id), COUNT(*) FROM (SELECT id FROM article_history WHERE article_id IS NULL AND id > ? ORDER BY id LIMIT ?)",
+            (last_id, batch_size)
+        )
+        batch_last, count = c.fetchone()
+        if not count:
+            break
+        c.execute("""
+            UPDATE article_history
+            SET article_id = (SELECT a.id FROM articles a WHERE a.slug = article_history.slug)
+            WHERE article_id IS NULL AND id > ? AND id <= ?
+        """, (last_id, batch_last))
+        conn.commit()
+        last_id = batch_last
+        done += count
+    return done
+
+def welcome_text():
+    return f"""Olá, parece que você acabou de instalar a AWE!\nA Wiki {wiki_config['APP_TITLE']} já foi configurada e agora você pode expandir-ela!\nTambém confira nossas recomendações no site!\nObrigado por instalar a ApoloWikiEngine (AWE).\n==Mais==\nVeja no site:\n1. Como personalizar melhor minha wiki?\n2. Como funciona a AWE?\n3. Como posso adaptar do php (MediaWiki) para python?"""
+
+def seed_db(c):
+    # usuário admin
+    c.execute("INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
+              ("admin", "batman17K", 1))
+
+    # artigo inicial
+    c.execute("""
+        INSERT INTO articles (slug, title, content, last_edited, last_editor)
+        VALUES (?, ?, ?, ?, ?)
+    """, (
+        f"{wiki_config['APP_TITLE']}:PP",
+        f"{wiki_config['APP_TITLE']}:PP",
+        welcome_text(),
+        datetime.now().isoformat(),
+        "admin"
+    ))
+
 def init_db():
-    first = not os.path.exists(DB_FILE)
+    first = not os.path.exists(wiki_config['DB_FILE'])
     conn = get_db()
     c = conn.cursor()
 
@@ -149,9 +533,27 @@ def init_db():
         content TEXT NOT NULL,
         ts TEXT NOT NULL,
         user TEXT,
-        summary TEXT
+        summary TEXT,
+        size INTEGER,
+        size_delta INTEGER,
+        content_hash TEXT,
+        parent_rev_id INTEGER,
+        article_id INTEGER REFERENCES articles(id)
     )
     ''')
+    # colunas que entraram depois; bancos antigos ganham via ALTER e o backfill-history preenche
+    ensure_columns(c, "article_history", {
+        "size": "INTEGER",
+        "size_delta": "INTEGER",
+        "content_hash": "TEXT",
+        "parent_rev_id": "INTEGER",
+        "article_id": "INTEGER REFERENCES articles(id)"
+    })
+    # o histórico aponta pro artigo pelo id; slug ficou só como o nome da página na época da revisão
+    c.execute("DROP INDEX IF EXISTS idx_article_history_slug")
+    c.execute("DROP INDEX IF EXISTS idx_article_history_hash")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_article_history_article ON article_history (article_id, id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_article_history_article_hash ON article_history (article_id, content_hash)")
 
     # DISCUSSIONS (topics + replies)
     c.execute('''
@@ -167,27 +569,37 @@ def init_db():
     )
     ''')
 
+    c.execute("CREATE INDEX IF NOT EXISTS idx_discussions_article ON discussions (article_id, parent_id, ts)")
+
+    # USER STATS (mantido a cada edição por record_revision)
+    c.execute('''
+    CREATE TABLE IF NOT EXISTS user_stats (
+        user TEXT PRIMARY KEY,
+        edit_count INTEGER NOT NULL DEFAULT 0,
+        first_edit TEXT,
+        last_edit TEXT,
+        pages_touched INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_article_history_user ON article_history (user, id)")
+
     conn.commit()
 
+    # bancos anteriores ao article_id: liga o histórico aos artigos em lotes
+    backfill_article_ids(conn)
+
+    # bancos anteriores ao user_stats: calcula os contadores uma vez a partir do histórico
+    c.execute("SELECT 1 FROM user_stats LIMIT 1")
+    if c.fetchone() is None:
+        c.execute('SELECT 1 FROM article_history WHERE "user" IS NOT NULL LIMIT 1')
+        if c.fetchone() is not None:
+            rebuild_user_stats(c)
+            conn.commit()
+
     # Popula DB inicial
     if first:
         try:
-            # usuário admin
-            c.execute("INSERT INTO users (username, password, is_admin) VALUES (?, ?, ?)",
-                      ("admin", "batman17K", 1))
-
-            # artigo inicial
-            c.execute("""
-                INSERT INTO articles (slug, title, content, last_edited, last_editor)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                f"{APP_TITLE}:PP",
-                f"{APP_TITLE}:PP",
-                f"""Olá, parece que você acabou de instalar a AWE!\nA Wiki {APP_TITLE} já foi configurada e agora você pode expandir-ela!\nTambém confira nossas recomendações no site!\nObrigado por instalar a ApoloWikiEngine (AWE).\n==Mais==\nVeja no site:\n1. Como personalizar melhor minha wiki?\n2. Como funciona a AWE?\n3. Como posso adaptar do php (MediaWiki) para python?""",
-                datetime.now().isoformat(),
-                "admin"
-            ))
-
+            seed_db(c)
             conn.commit()
             print("DB criada e povoada (usuario admin/admin).")
         except Exception as e:
@@ -196,7 +608,6 @@ def init_db():
     conn.close()
 
 # ---------- HELPERS ----------
-safe = escape(texto)
 
 def sanitize_text(text):
     # lista branca mínima
@@ -210,10 +621,103 @@ def sanitize_text(text):
         strip=True
     )
 
-def get_user():
-    if 'username' in session:
-        return {'username': session['username']}
-    return None
+def content_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+def last_revision(c, article_id):
+    c.execute("SELECT id, size, content_hash FROM article_history WHERE article_id=? ORDER BY id DESC LIMIT 1", (article_id,))
+    return c.fetchone()
+
+def record_revision(c, article, content, ts, user, summary=None, parent=None):
+    """Grava uma revisão no histórico com tamanho, delta, hash e revisão pai.
+
+    Tudo é calculado uma vez aqui, na escrita, pra que as listagens não
+    precisem ler o conteúdo. Se o conteúdo bate com uma versão anterior do
+    mesmo artigo e não veio resumo, a edição é marcada como reversão.
+    `article` é a linha do artigo (precisa de id e slug).
+    """
+    if parent is None:
+        parent = last_revision(c, article['id'])
+    size = len(content.encode("utf-8"))
+    digest = content_hash(content)
+    size_delta = size
+    if parent:
+        size_delta = size - parent['size'] if parent['size'] is not None else None
+
+    if not summary:
+        c.execute("""
+            SELECT id FROM article_history
+            WHERE article_id=? AND content_hash=? AND id<>?
+            ORDER BY id DESC LIMIT 1
+        """, (article['id'], digest, parent['id'] if parent else 0))
+        reverted = c.fetchone()
+        if reverted:
+            summary = f"Revertido para a versão {reverted['id']}"
+
+    if user:
+        # precisa olhar antes do INSERT pra saber se é a primeira edição do usuário nessa página
+        c.execute('SELECT 1 FROM article_history WHERE "user"=? AND article_id=? LIMIT 1', (user, article['id']))
+        new_page = c.fetchone() is None
+        c.execute("""
+            INSERT INTO user_stats ("user", edit_count, first_edit, last_edit, pages_touched)
+            VALUES (?, 1, ?, ?, 1)
+            ON CONFLICT("user") DO UPDATE SET
+                edit_count = user_stats.edit_count + 1,
+                last_edit = excluded.last_edit,
+                pages_touched = user_stats.pages_touched + ?
+        """, (user, ts, ts, int(new_page)))
+
+    c.execute("""
+        INSERT INTO article_history (article_id, slug, content, ts, "user", summary, size, size_delta, content_hash, parent_rev_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING id
+    """, (article['id'], article['slug'], content, ts, user, summary, size, size_delta, digest, parent['id'] if parent else None))
+    return c.fetchone()['id']
+
+def rebuild_user_stats(c):
+    """Recalcula user_stats inteiro a partir do histórico (import em massa, bancos antigos)."""
+    c.execute("DELETE FROM user_stats")
+    c.execute("""
+        INSERT INTO user_stats ("user", edit_count, first_edit, last_edit, pages_touched)
+        SELECT "user", COUNT(*), MIN(ts), MAX(ts), COUNT(DISTINCT article_id)
+        FROM article_history
+        WHERE "user" IS NOT NULL
+        GROUP BY "user"
+    """)
+
+def load_discussions(c, article_id, fragment="discussion"):
+    """Versão, tópicos e respostas das discussões de um artigo.
+
+    Se o fragmento dessa versão já está em cache, devolve listas vazias e
+    nem lê as discussões. `fragment` é o nome do bloco no template (o espelho
+    estático usa outro, sem os botões da app).
+    """
+    c.execute("SELECT MAX(ts) AS version FROM discussions WHERE article_id=?", (article_id,))
+    version = c.fetchone()['version'] or ""
+    if fragment_cache.pin((fragment, article_id, version)):
+        return version, [], {}
+
+    c.execute("SELECT * FROM discussions WHERE article_id=? AND parent_id IS NULL ORDER BY ts DESC", (article_id,))
+    topics = c.fetchall()
+    c.execute("SELECT * FROM discussions WHERE article_id=? AND parent_id IS NOT NULL ORDER BY ts ASC", (article_id,))
+    replies_map = {}
+    for r in c.fetchall():
+        replies_map.setdefault(r['parent_id'], []).append(r)
+    return version, topics, replies_map
+
+def load_history(c, article_id, fragment="history"):
+    """Versão (id e ts da última revisão) e linhas do histórico, com o mesmo esquema de cache.
+
+    O id sozinho não serve de versão: o restore-db volta o AUTOINCREMENT e
+    uma revisão nova pode herdar o id de uma que sumiu.
+    """
+    c.execute("SELECT id, ts FROM article_history WHERE article_id=? ORDER BY id DESC LIMIT 1", (article_id,))
+    head = c.fetchone()
+    version = (head['id'], head['ts']) if head else 0
+    if fragment_cache.pin((fragment, article_id, version)):
+        return version, []
+    c.execute('SELECT id, ts, "user", summary, size, size_delta FROM article_history WHERE article_id=? ORDER BY ts DESC', (article_id,))
+    return version, c.fetchall()
 
 def get_real_ip():
     try:
@@ -223,7 +727,6 @@ def get_real_ip():
     except:
         return None
 
-@limiter.limit("50 per minute")
 @app.after_request
 def set_csp(response):
     response.headers['Content-Security-Policy'] = (
@@ -237,202 +740,840 @@ def set_csp(response):
     )
     return response
 
+# ---------- REPOSITÓRIO ----------
+# artigos, histórico, discussões e usuários passam por aqui. O SQL é um só pros
+# dois bancos ("?" como placeholder, "user" entre aspas, RETURNING); cada backend
+# só sabe abrir transação, varrer tabela grande e criar o schema. Backup,
+# import/export de dumps e o rate limit continuam sendo coisa do SQLite.
+DB_BACKEND = wiki_config.get("DB_BACKEND", "sqlite")  # "sqlite" ou "postgres" (troca pede restart)
+PG_POOL_MIN = 1
+PG_POOL_MAX = 10
+SCAN_BATCH_SIZE = 500  # linhas por ida ao servidor nas varreduras grandes
+ROLLBACK_CHUNK_SIZE = 200  # artigos por transação na reversão em massa (limita o tempo de lock)
+
+class DuplicateError(Exception):
+    """Slug ou username que já existe."""
+
+class Repository:
+    """Operações da wiki em cima de um banco; as subclasses cuidam da conexão.
+
+    transaction() entrega um cursor que aceita "?" e devolve linhas acessíveis
+    por nome; commit na saída normal, rollback se der exceção.
+    """
+
+    like = "LIKE"
+    integrity_errors = ()
+
+    @property
+    def name(self):
+        """Identifica o banco nos caches por processo (ex.: revision_diff)."""
+        raise NotImplementedError
+
+    def transaction(self):
+        raise NotImplementedError
+
+    def scan(self, sql, params=()):
+        """Gera as linhas de uma consulta grande sem carregar tudo na memória."""
+        raise NotImplementedError
+
+    def init_schema(self):
+        raise NotImplementedError
+
+    def _one(self, sql, params=()):
+        with self.transaction() as c:
+            c.execute(sql, params)
+            return c.fetchone()
+
+    def _all(self, sql, params=()):
+        with self.transaction() as c:
+            c.execute(sql, params)
+            return c.fetchall()
+
+    # --- artigos ---
+    def get_article(self, slug):
+        return self._one("SELECT * FROM articles WHERE slug=?", (slug,))
+
+    def get_article_by_id(self, article_id):
+        return self._one("SELECT * FROM articles WHERE id=?", (article_id,))
+
+    def find_article(self, slug):
+        """Pelo slug ou, se não achar, pelo primeiro título parecido."""
+        return self.get_article(slug) or self._one(
+            f"SELECT * FROM articles WHERE title {self.like} ? LIMIT 1", ('%' + slug + '%',)
+        )
+
+    def ensure_article(self, slug, title, content, editor=None):
+        """Devolve o artigo, criando com esse conteúdo se ainda não existir."""
+        with self.transaction() as c:
+            c.execute("""
+                INSERT INTO articles (slug, title, content, last_edited, last_editor)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(slug) DO NOTHING
+            """, (slug, title, content, datetime.now().isoformat(), editor))
+            c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
+            return c.fetchone()
+
+    def random_slug(self):
+        row = self._one("SELECT slug FROM articles ORDER BY RANDOM() LIMIT 1")
+        return row['slug'] if row else None
+
+    def search_articles(self, q, limit=50):
+        pattern = '%' + q + '%'
+        return self._all(
+            f"SELECT * FROM articles WHERE title {self.like} ? OR content {self.like} ? LIMIT ?",
+            (pattern, pattern, limit)
+        )
+
+    def update_article(self, article, content, user):
+        """Grava a revisão e o conteúdo novo na mesma transação.
+
+        A revisão pai é lida dentro dessa mesma transação.
+        """
+        ts = datetime.now().isoformat()
+        with self.transaction() as c:
+            record_revision(c, article, content, ts, user)
+            c.execute(
+                "UPDATE articles SET content=?, last_edited=?, last_editor=? WHERE id=?",
+                (content, ts, user, article['id'])
+            )
+
+    def move_article(self, article, new_slug, user):
+        """Renomeia e registra uma revisão nula. Levanta DuplicateError se o nome existe."""
+        ts = datetime.now().isoformat()
+        try:
+            with self.transaction() as c:
+                c.execute(
+                    "UPDATE articles SET slug=?, title=?, last_edited=?, last_editor=? WHERE id=?",
+                    (new_slug, new_slug, ts, user, article['id'])
+                )
+                record_revision(c, {"id": article['id'], "slug": new_slug}, article['content'], ts, user,
+                                summary=f"Moveu de {article['slug']} para {new_slug}")
+        except self.integrity_errors:
+            raise DuplicateError(new_slug)
+
+    def iter_articles(self):
+        return self.scan("SELECT * FROM articles ORDER BY id")
+
+    def iter_articles_with_discussion_version(self):
+        """Artigos com a versão das discussões (MAX(ts), ou NULL) numa consulta só."""
+        return self.scan("""
+            SELECT a.*, d.version AS discussion_version
+            FROM articles a
+            LEFT JOIN (
+                SELECT article_id, MAX(ts) AS version FROM discussions GROUP BY article_id
+            ) d ON d.article_id = a.id
+            ORDER BY a.id
+        """)
+
+    # --- histórico ---
+    def last_revision(self, article_id):
+        with self.transaction() as c:
+            return last_revision(c, article_id)
+
+    def history(self, article_id, fragment="history"):
+        with self.transaction() as c:
+            return load_history(c, article_id, fragment)
+
+    def revision(self, rev_id):
+        return self._one("SELECT * FROM article_history WHERE id=?", (rev_id,))
+
+    def revisions(self, ids):
+        """Metadados das revisões pedidas, sem o conteúdo."""
+        ids = tuple(ids)
+        return self._all(
+            f'SELECT id, article_id, ts, "user", summary, content_hash FROM article_history WHERE id IN ({", ".join("?" * len(ids))})',
+            ids
+        )
+
+    def revision_contents(self, ids):
+        ids = tuple(ids)
+        return self._all(
+            f'SELECT id, content FROM article_history WHERE id IN ({", ".join("?" * len(ids))})',
+            ids
+        )
+
+    def revision_list(self, article_id):
+        return self._all('SELECT id, ts, "user" FROM article_history WHERE article_id=? ORDER BY ts DESC', (article_id,))
+
+    def iter_revisions(self, article_id):
+        return self.scan(
+            'SELECT id, content, ts, "user", summary FROM article_history WHERE article_id=? ORDER BY id',
+            (article_id,)
+        )
+
+    def recent_changes(self, limit=50):
+        return self._all("""
+            SELECT a.title, h.ts, h."user", h.summary, h.size, h.size_delta
+            FROM article_history h
+            JOIN articles a ON a.id = h.article_id
+            ORDER BY h.ts DESC
+            LIMIT ?
+        """, (limit,))
+
+    def contributions(self, user, before=None, limit=50):
+        """Edições do usuário com id < before, mais novas primeiro (keyset)."""
+        return self._all("""
+            SELECT 
+                h.id,
+                COALESCE(a.slug, h.slug) AS slug,
+                h.ts,
+                h."user",
+                h.summary,
+                h.size_delta,
+                a.title
+            FROM article_history h
+            LEFT JOIN articles a ON a.id = h.article_id
+            WHERE h."user" = ? AND h.id < ?
+            ORDER BY h.id DESC
+            LIMIT ?
+        """, (user, before or sys.maxsize, limit))
+
+    def user_stats(self, user):
+        return self._one('SELECT * FROM user_stats WHERE "user"=?', (user,))
+
+    # --- reversão em massa ---
+    def rollback_targets(self, user):
+        """Artigos cuja última revisão é de `user`, com a última revisão de outra pessoa.
+
+        Uma consulta só, com janela por artigo. good_id vem None quando todas
+        as revisões do artigo são do próprio usuário (página criada por ele).
+        """
+        return self._all("""
+            WITH touched AS (
+                SELECT DISTINCT article_id FROM article_history
+                WHERE "user" = ? AND article_id IS NOT NULL
+            ),
+            ranked AS (
+                SELECT h.article_id, h.id,
+                       COALESCE(h."user", '') = ? AS by_user,
+                       FIRST_VALUE(h."user") OVER (PARTITION BY h.article_id ORDER BY h.id DESC) AS head_user
+                FROM article_history h
+                JOIN touched t ON t.article_id = h.article_id
+            )
+            SELECT r.article_id, a.slug, r.good_id
+            FROM (
+                SELECT article_id, MAX(CASE WHEN NOT by_user THEN id END) AS good_id
+                FROM ranked
+                WHERE head_user = ?
+                GROUP BY article_id
+            ) r
+            JOIN articles a ON a.id = r.article_id
+            ORDER BY r.article_id
+        """, (user, user, user))
+
+    def rollback_user_edits(self, user, by, chunk_size=ROLLBACK_CHUNK_SIZE, progress=None):
+        """Volta cada artigo em que `user` fez a última edição pra última revisão boa.
+
+        Vai em transações de chunk_size artigos. O conteúdo é copiado dentro do
+        banco (INSERT ... SELECT e UPDATE com subconsulta), sem passar pela app.
+        Artigo que outra pessoa editou depois da consulta fica como está.
+        progress(feitos, total) é chamado a cada chunk. Devolve (revertidos, ignorados).
+        """
+        targets = self.rollback_targets(user)
+        good_ids = [row['good_id'] for row in targets if row['good_id'] is not None]
+        skipped = len(targets) - len(good_ids)
+        restored = 0
+        summary = f"Revertidas as edições de {user} (volta para a versão "
+        for start in range(0, len(good_ids), chunk_size):
+            chunk = good_ids[start:start + chunk_size]
+            marks = ", ".join("?" * len(chunk))
+            ts = datetime.now().isoformat()
+            with self.transaction() as c:
+                # páginas em que quem reverte já tinha editado (pro pages_touched)
+                c.execute(f"""
+                    SELECT DISTINCT h.article_id FROM article_history h
+                    JOIN article_history g ON g.article_id = h.article_id
+                    WHERE g.id IN ({marks}) AND h."user" = ?
+                """, (*chunk, by))
+                touched = {row['article_id'] for row in c.fetchall()}
+
+                c.execute(f"""
+                    INSERT INTO article_history (article_id, slug, content, ts, "user", summary, size, size_delta, content_hash, parent_rev_id)
+                    SELECT g.article_id, a.slug, g.content, ?, ?, CAST(? AS TEXT) || CAST(g.id AS TEXT) || ')',
+                           g.size, g.size - head.size, g.content_hash, head.id
+                    FROM article_history g
+                    JOIN articles a ON a.id = g.article_id
+                    JOIN article_history head ON head.id = (
+                        SELECT MAX(x.id) FROM article_history x WHERE x.article_id = g.article_id
+                    )
+                    WHERE g.id IN ({marks}) AND head."user" = ?
+                    RETURNING article_id
+                """, (ts, by, summary, *chunk, user))
+                done = [row['article_id'] for row in c.fetchall()]
+                if done:
+                    c.execute(f"""
+                        UPDATE articles SET
+                            content = (
+                                SELECT h.content FROM article_history h
+                                WHERE h.id = (SELECT MAX(x.id) FROM article_history x WHERE x.article_id = articles.id)
+                            ),
+                            last_edited = ?,
+                            last_editor = ?
+                        WHERE id IN ({", ".join("?" * len(done))})
+                    """, (ts, by, *done))
+                    c.execute("""
+                        INSERT INTO user_stats ("user", edit_count, first_edit, last_edit, pages_touched)
+                        VALUES (?, ?, ?, ?, ?)
+                        ON CONFLICT("user") DO UPDATE SET
+                            edit_count = user_stats.edit_count + excluded.edit_count,
+                            last_edit = excluded.last_edit,
+                            pages_touched = user_stats.pages_touched + excluded.pages_touched
+                    """, (by, len(done), ts, ts, len(set(done) - touched)))
+            restored += len(done)
+            if progress:
+                progress(start + len(chunk), len(good_ids))
+        return restored, skipped
+
+    # --- discussões ---
+    def discussions(self, article_id, fragment="discussion"):
+        with self.transaction() as c:
+            return load_discussions(c, article_id, fragment)
+
+    def get_topic(self, article_id, topic_id):
+        return self._one(
+            'SELECT id, "user" FROM discussions WHERE id=? AND article_id=? AND parent_id IS NULL',
+            (topic_id, article_id)
+        )
+
+    def add_discussion(self, article_id, user, text, title=None, parent_id=None, reply_to=None):
+        with self.transaction() as c:
+            c.execute("""
+                INSERT INTO discussions (article_id, parent_id, topic_title, comment_text, "user", reply_to, ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, (article_id, parent_id, title, text, user, reply_to, datetime.now().isoformat()))
+
+    # --- usuários ---
+    def get_user(self, username):
+        return self._one("SELECT * FROM users WHERE username=?", (username,))
+
+    def create_user(self, username, password):
+        try:
+            with self.transaction() as c:
+                c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password))
+        except self.integrity_errors:
+            raise DuplicateError(username)
+
+    def set_password(self, user_id, password):
+        with self.transaction() as c:
+            c.execute("UPDATE users SET password=? WHERE id=?", (password, user_id))
+
+class SQLiteRepository(Repository):
+    """Padrão: o arquivo DB_FILE do config, uma conexão por operação."""
+
+    integrity_errors = (sqlite3.IntegrityError,)
+
+    @property
+    def name(self):
+        return wiki_config["DB_FILE"]
+
+    @contextmanager
+    def transaction(self):
+        conn = get_db()
+        try:
+            yield conn.cursor()
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def scan(self, sql, params=()):
+        # o cursor do sqlite já anda linha a linha
+        conn = get_db()
+        try:
+            yield from conn.execute(sql, params)
+        finally:
+            conn.close()
+
+    def init_schema(self):
+        init_db()
+
+# schema equivalente ao do init_db; "user" é palavra reservada no PostgreSQL
+PG_SCHEMA = (
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id BIGSERIAL PRIMARY KEY,
+        username TEXT UNIQUE NOT NULL,
+        password TEXT NOT NULL,
+        is_admin INTEGER DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS articles (
+        id BIGSERIAL PRIMARY KEY,
+        slug TEXT UNIQUE NOT NULL,
+        title TEXT NOT NULL,
+        content TEXT NOT NULL,
+        last_edited TEXT,
+        last_editor TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS article_history (
+        id BIGSERIAL PRIMARY KEY,
+        slug TEXT NOT NULL,
+        content TEXT NOT NULL,
+        ts TEXT NOT NULL,
+        "user" TEXT,
+        summary TEXT,
+        size INTEGER,
+        size_delta INTEGER,
+        content_hash TEXT,
+        parent_rev_id BIGINT,
+        article_id BIGINT REFERENCES articles(id)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_article_history_article ON article_history (article_id, id)",
+    "CREATE INDEX IF NOT EXISTS idx_article_history_article_hash ON article_history (article_id, content_hash)",
+    'CREATE INDEX IF NOT EXISTS idx_article_history_user ON article_history ("user", id)',
+    """
+    CREATE TABLE IF NOT EXISTS discussions (
+        id BIGSERIAL PRIMARY KEY,
+        article_id BIGINT,
+        parent_id BIGINT,
+        topic_title TEXT,
+        comment_text TEXT NOT NULL,
+        "user" TEXT,
+        reply_to TEXT,
+        ts TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_discussions_article ON discussions (article_id, parent_id, ts)",
+    """
+    CREATE TABLE IF NOT EXISTS user_stats (
+        "user" TEXT PRIMARY KEY,
+        edit_count INTEGER NOT NULL DEFAULT 0,
+        first_edit TEXT,
+        last_edit TEXT,
+        pages_touched INTEGER NOT NULL DEFAULT 0
+    )
+    """,
+)
+PG_SCHEMA_LOCK = 0x415745  # advisory lock pros workers não criarem o schema ao mesmo tempo
+
+class PgCursor:
+    """Cursor do psycopg com a cara do sqlite3: aceita "?" como placeholder."""
+
+    def __init__(self, cur):
+        self.cur = cur
+
+    def execute(self, sql, params=()):
+        self.cur.execute(sql.replace("?", "%s"), params)
+        return self
+
+    def executemany(self, sql, seq):
+        self.cur.executemany(sql.replace("?", "%s"), seq)
+        return self
+
+    def fetchone(self):
+        return self.cur.fetchone()
+
+    def fetchall(self):
+        return self.cur.fetchall()
+
+    def __iter__(self):
+        return iter(self.cur)
+
+    @property
+    def rowcount(self):
+        return self.cur.rowcount
+
+class PostgresRepository(Repository):
+    """PostgreSQL via pool do psycopg; varreduras usam cursor no servidor."""
+
+    like = "ILIKE"
+
+    def __init__(self, url, min_size=PG_POOL_MIN, max_size=PG_POOL_MAX):
+        if psycopg is None:
+            raise RuntimeError("DB_BACKEND=postgres precisa dos pacotes psycopg e psycopg_pool.")
+        self.url = url
+        self.integrity_errors = (psycopg.IntegrityError,)
+        self.pool = ConnectionPool(
+            url, min_size=min_size, max_size=max_size,
+            kwargs={"row_factory": dict_row}, open=True
+        )
+
+    @property
+    def name(self):
+        return self.url
+
+    @contextmanager
+    def transaction(self):
+        # o pool faz commit na saída normal e rollback se escapar exceção
+        with self.pool.connection() as conn:
+            yield PgCursor(conn.cursor())
+
+    def scan(self, sql, params=()):
+        # cursor nomeado = cursor no servidor; só SCAN_BATCH_SIZE linhas por vez na memória
+        with self.pool.connection() as conn:
+            with conn.cursor(name=f"scan_{uuid.uuid4().hex}") as cur:
+                cur.itersize = SCAN_BATCH_SIZE
+                cur.execute(sql.replace("?", "%s"), params)
+                yield from cur
+
+    def init_schema(self):
+        with self.transaction() as c:
+            c.execute("SELECT pg_advisory_xact_lock(?)", (PG_SCHEMA_LOCK,))
+            for statement in PG_SCHEMA:
+                c.execute(statement)
+            c.execute("SELECT 1 FROM users LIMIT 1")
+            if c.fetchone() is None:
+                seed_db(c)
+
+def make_repository():
+    if DB_BACKEND == "postgres":
+        return PostgresRepository(wiki_config["DATABASE_URL"])
+    return SQLiteRepository()
+
+repo = make_repository()
+
+def require_sqlite(feature):
+    # backup, import e backfills mexem direto no DB_FILE; com outro backend
+    # eles operariam num sqlite local vazio e ainda diriam que deu certo
+    if DB_BACKEND != "sqlite":
+        raise click.ClickException(f"{feature} só funciona com DB_BACKEND=sqlite (atual: {DB_BACKEND}).")
+
+# ---------- DIFF ----------
+# patience diff: casa primeiro as linhas únicas nos dois lados (âncoras) e
+# resolve o que sobra entre elas; perto de linear pra texto de wiki normal
+DIFF_CACHE_SIZE = 256        # pares de revisões renderizados mantidos por worker
+DIFF_CONTEXT = 3             # linhas iguais mostradas em volta de cada mudança
+DIFF_FALLBACK_LIMIT = 250000 # n*m máximo pro SequenceMatcher em regiões sem âncoras
+DIFF_WORD_LIMIT = 2000       # linhas maiores que isso não ganham diff por palavra
+DIFF_TOKEN_RE = re.compile(r"\w+|\s+|[^\w\s]")
+
+def _unique_pairs(a, alo, ahi, b, blo, bhi):
+    a_pos = {}
+    for i in range(alo, ahi):
+        a_pos[a[i]] = None if a[i] in a_pos else i
+    b_pos = {}
+    for j in range(blo, bhi):
+        b_pos[b[j]] = None if b[j] in b_pos else j
+    pairs = [(a_pos[x], j) for x, j in b_pos.items() if j is not None and a_pos.get(x) is not None]
+    pairs.sort(key=lambda p: p[1])
+    return pairs
+
+def _longest_increasing(pairs):
+    # patience sorting: maior subsequência com i e j crescentes, O(n log n)
+    tails = []
+    tail_values = []
+    prev = [None] * len(pairs)
+    for k, (i, _) in enumerate(pairs):
+        pos = bisect.bisect_left(tail_values, i)
+        if pos:
+            prev[k] = tails[pos - 1]
+        if pos == len(tails):
+            tails.append(k)
+            tail_values.append(i)
+        else:
+            tails[pos] = k
+            tail_values[pos] = i
+    result = []
+    k = tails[-1] if tails else None
+    while k is not None:
+        result.append(pairs[k])
+        k = prev[k]
+    result.reverse()
+    return result
+
+def diff_sequences(a, b):
+    """Compara duas sequências e retorna opcodes no formato do difflib (tag, i1, i2, j1, j2).
+
+    Regiões sem nenhuma âncora única caem no SequenceMatcher se forem pequenas
+    o bastante; acima de DIFF_FALLBACK_LIMIT viram um replace inteiro, pra
+    entrada patológica não travar o worker.
+    """
+    matches = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        alo, ahi, blo, bhi = stack.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo, 1))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi, 1))
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _longest_increasing(_unique_pairs(a, alo, ahi, b, blo, bhi))
+        if anchors:
+            last_i, last_j = alo, blo
+            for i, j in anchors:
+                stack.append((last_i, i, last_j, j))
+                matches.append((i, j, 1))
+                last_i, last_j = i + 1, j + 1
+            stack.append((last_i, ahi, last_j, bhi))
+        elif (ahi - alo) * (bhi - blo) <= DIFF_FALLBACK_LIMIT:
+            sm = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for i, j, size in sm.get_matching_blocks():
+                if size:
+                    matches.append((alo + i, blo + j, size))
+
+    matches.sort()
+    matches.append((len(a), len(b), 0))
+    opcodes = []
+    i = j = 0
+    for mi, mj, size in matches:
+        if i < mi and j < mj:
+            opcodes.append(('replace', i, mi, j, mj))
+        elif i < mi:
+            opcodes.append(('delete', i, mi, j, mj))
+        elif j < mj:
+            opcodes.append(('insert', i, mi, j, mj))
+        if size:
+            if opcodes and opcodes[-1][0] == 'equal' and opcodes[-1][2] == mi and opcodes[-1][4] == mj:
+                opcodes[-1] = ('equal', opcodes[-1][1], mi + size, opcodes[-1][3], mj + size)
+            else:
+                opcodes.append(('equal', mi, mi + size, mj, mj + size))
+        i, j = mi + size, mj + size
+    return opcodes
+
+def diff_words(old_line, new_line):
+    """Marca com <del>/<ins> só as palavras que mudaram entre duas linhas."""
+    if len(old_line) > DIFF_WORD_LIMIT or len(new_line) > DIFF_WORD_LIMIT:
+        return Markup("<del>%s</del>") % old_line, Markup("<ins>%s</ins>") % new_line
+    a = DIFF_TOKEN_RE.findall(old_line)
+    b = DIFF_TOKEN_RE.findall(new_line)
+    old_html = []
+    new_html = []
+    for tag, i1, i2, j1, j2 in diff_sequences(a, b):
+        if tag == 'equal':
+            old_html.append(escape("".join(a[i1:i2])))
+            new_html.append(escape("".join(b[j1:j2])))
+            continue
+        if i1 < i2:
+            old_html.append(Markup("<del>%s</del>") % "".join(a[i1:i2]))
+        if j1 < j2:
+            new_html.append(Markup("<ins>%s</ins>") % "".join(b[j1:j2]))
+    return Markup("").join(old_html), Markup("").join(new_html)
+
+def render_diff(old, new, context=DIFF_CONTEXT):
+    """Diff por linha + palavra de dois textos.
+
+    Retorna (linhas, adicionadas, removidas); cada linha é um dict com kind
+    ('equal', 'del', 'ins' ou 'skip'), os números de linha e o html já escapado.
+    """
+    a = old.splitlines()
+    b = new.splitlines()
+    opcodes = diff_sequences(a, b)
+    rows = []
+    added = removed = 0
+    for n, (tag, i1, i2, j1, j2) in enumerate(opcodes):
+        if tag == 'equal':
+            keep_head = 0 if n == 0 else context
+            keep_tail = 0 if n == len(opcodes) - 1 else context
+            if i2 - i1 > keep_head + keep_tail:
+                for k in range(keep_head):
+                    rows.append({"kind": "equal", "old": i1 + k + 1, "new": j1 + k + 1, "html": escape(a[i1 + k])})
+                rows.append({"kind": "skip", "old": None, "new": None, "html": Markup("&hellip;")})
+                for k in range(i2 - i1 - keep_tail, i2 - i1):
+                    rows.append({"kind": "equal", "old": i1 + k + 1, "new": j1 + k + 1, "html": escape(a[i1 + k])})
+            else:
+                for k in range(i2 - i1):
+                    rows.append({"kind": "equal", "old": i1 + k + 1, "new": j1 + k + 1, "html": escape(a[i1 + k])})
+            continue
+
+        removed += i2 - i1
+        added += j2 - j1
+        paired = min(i2 - i1, j2 - j1) if tag == 'replace' else 0
+        old_rows = []
+        new_rows = []
+        for k in range(paired):
+            old_html, new_html = diff_words(a[i1 + k], b[j1 + k])
+            old_rows.append({"kind": "del", "old": i1 + k + 1, "new": None, "html": old_html})
+            new_rows.append({"kind": "ins", "old": None, "new": j1 + k + 1, "html": new_html})
+        for k in range(i1 + paired, i2):
+            old_rows.append({"kind": "del", "old": k + 1, "new": None, "html": escape(a[k])})
+        for k in range(j1 + paired, j2):
+            new_rows.append({"kind": "ins", "old": None, "new": k + 1, "html": escape(b[k])})
+        rows.extend(old_rows)
+        rows.extend(new_rows)
+    return rows, added, removed
+
+def revision_key(row):
+    return (row['id'], row['ts'], row['content_hash'])
+
+@lru_cache(maxsize=DIFF_CACHE_SIZE)
+def revision_diff(db_name, old_key, new_key):
+    """Linhas do diff entre duas revisões (rows, added, removed), em LRU.
+
+    As chaves vêm de revision_key: o id sozinho não basta, porque o
+    restore-db volta o AUTOINCREMENT e um id pode ser reaproveitado por
+    outra revisão. Com ts e hash na chave, o diff antigo só deixa de ser
+    achado. O nome do banco entra porque ele pode trocar pelo /config.
+    Revisão inexistente levanta LookupError, que o lru_cache não guarda.
+    """
+    found = {row['id']: row['content'] for row in repo.revision_contents((old_key[0], new_key[0]))}
+    if old_key[0] not in found or new_key[0] not in found:
+        raise LookupError("Versão não encontrada.")
+    return render_diff(found[old_key[0]], found[new_key[0]])
+
 # ---------- ROUTES PRINCIPAIS ----------
 # home
 @app.route('/')
 def home():
     cu = get_user()
-    conn = get_db()
-    c = conn.cursor()
     # tenta pegar o artigo Lusopédia:PP
-    c.execute("SELECT * FROM articles WHERE slug=?", ("Lusopédia:PP",))
-    article = c.fetchone()
+    article = repo.get_article("Lusopédia:PP")
     if not article:
-        c.execute("""
-                INSERT INTO articles (slug, title, content, last_edited, last_editor)
-                VALUES (?, ?, ?, ?, ?)
-            """, (
-                f"{APP_TITLE}:PP",
-                f"{APP_TITLE}:PP",
-                f"""Olá, parece que você acabou de instalar a AWE!\nA Wiki {APP_TITLE} já foi configurada e agora você pode expandir-ela!\nTambém confira nossas recomendações no site!\nObrigado por instalar a ApoloWikiEngine (AWE).\n==Mais==\nVeja no site:\n1. Como personalizar melhor minha wiki?\n2. Como funciona a AWE?\n3. Como posso adaptar do php (MediaWiki) para python?""",
-                datetime.now().isoformat(),
-                "admin"
-        ))
-    # pega tópicos do artigo
-    c.execute("SELECT * FROM discussions WHERE article_id=? AND parent_id IS NULL ORDER BY ts DESC", (article['id'],))
-    topics = c.fetchall()
-    # pega replies
-    replies_map = {}
-    c.execute("SELECT * FROM discussions WHERE article_id=? AND parent_id IS NOT NULL ORDER BY ts ASC", (article['id'],))
-    replies = c.fetchall()
-    for r in replies:
-        replies_map.setdefault(r['parent_id'], []).append(r)
-    conn.close()
-    if os.path.exists(CONFIG_PATH):
-        return render_template("article.html", APP_TITLE=APP_TITLE, cu=cu, title=article['title'],
+        article = repo.ensure_article(
+            f"{wiki_config['APP_TITLE']}:PP",
+            f"{wiki_config['APP_TITLE']}:PP",
+            welcome_text(),
+            "admin"
+        )
+    # pega tópicos e replies do artigo
+    discussion_version, topics, replies_map = repo.discussions(article['id'])
+    if wiki_config.exists:
+        return render_template("article.html", cu=cu, title=article['title'],
                            slug=article['slug'], content=article['content'],
+                           article_id=article['id'], discussion_version=discussion_version,
                            discussion_topics=topics, discussion_replies=replies_map,
-                           last_edited=article['last_edited'], LICENSE=LICENSE)
+                           last_edited=article['last_edited'])
     else:
         return redirect("config")
 
 # configurador
 @app.route("/config", methods=["GET", "POST"])
 def edit_config():
-    global APP_TITLE, LICENSE, DB_FILE
     if request.method == "POST":
-        APP_TITLE = request.form.get("APP_TITLE","").strip() or APP_TITLE
-        LICENSE = request.form.get("LICENSE","").strip() or LICENSE
-        DB_FILE = request.form.get("DB_FILE","").strip() or DB_FILE
-
+        # mantém as chaves que não estão no formulário (DB_BACKEND, RATELIMIT_STORAGE_URI...)
         save_config({
-            "APP_TITLE": APP_TITLE,
-            "LICENSE": LICENSE,
-            "DB_FILE": DB_FILE
+            **wiki_config.data,
+            "APP_TITLE": request.form.get("APP_TITLE","").strip() or wiki_config["APP_TITLE"],
+            "LICENSE": request.form.get("LICENSE","").strip() or wiki_config["LICENSE"],
+            "DB_FILE": request.form.get("DB_FILE","").strip() or wiki_config["DB_FILE"]
         })
+        # os outros workers pegam a mudança pelo mtime no próximo refresh
+        wiki_config.reload()
         flash("Configurações salvas!", "success")
-        init_db()
+        repo.init_schema()
         return redirect(url_for("edit_config"))
 
-    return render_template("config.html",
-        APP_TITLE=APP_TITLE,
-        LICENSE=LICENSE,
-        DB_FILE=DB_FILE
-    )
+    return render_template("config.html", DB_FILE=wiki_config["DB_FILE"])
 
 # goto geral: aceita "random", "edit_article/<slug>", "history/<slug>" ou slug de artigo
 @app.route('/wiki/<path:slug>')
 def goto(slug):
     cu = get_user()
-    conn = get_db()
-    c = conn.cursor()
 
     # --- Casos especiais ---
     if slug == 'random':
-        c.execute("SELECT slug FROM articles")
-        rows = c.fetchall()
-        if not rows:
+        r = repo.random_slug()
+        if not r:
             flash("Sem artigos ainda.", "error")
-            conn.close()
             return redirect(url_for('home'))
-        r = random.choice(rows)['slug']
-        conn.close()
         return redirect(url_for('goto', slug=r))
 
     if slug.startswith('edit_article/'):
         inner = slug.split('/', 1)[1]
-        conn.close()
         return redirect(url_for('edit_article', slug=inner))
 
     if slug.startswith('history/'):
         inner = slug.split('/', 1)[1]
-        conn.close()
         return redirect(url_for('history', slug=inner))
 
-    # --- Pega artigo principal ---
-    c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-    article = c.fetchone()
-
+    # --- Pega artigo principal (ou tenta pelo título) ---
+    article = repo.find_article(slug)
     if not article:
-        # tenta pelo título
-        c.execute("SELECT * FROM articles WHERE title LIKE ?", ('%'+slug+'%',))
-        article = c.fetchone()
-        if not article:
-            flash(f"Artigo não encontrado: {slug}", "error")
-            conn.close()
-            return redirect(url_for('home'))
+        flash(f"Artigo não encontrado: {slug}", "error")
+        return redirect(url_for('home'))
 
     article_id = article['id']
 
     # --- Pega discussões ---
-    c.execute("SELECT * FROM discussions WHERE article_id=? AND parent_id IS NULL ORDER BY ts DESC", (article_id,))
-    topics = c.fetchall()
-
-    c.execute("SELECT * FROM discussions WHERE article_id=? AND parent_id IS NOT NULL ORDER BY ts ASC", (article_id,))
-    replies = c.fetchall()
-    replies_map = {}
-    for r in replies:
-        replies_map.setdefault(r['parent_id'], []).append(r)
+    discussion_version, topics, replies_map = repo.discussions(article_id)
 
     # --- Pega histórico ---
-    c.execute("SELECT id, content, ts, user, summary FROM article_history WHERE slug=? ORDER BY ts DESC", (slug,))
-    article_history = c.fetchall()
-
-    conn.close()
+    history_version, article_history = repo.history(article_id)
 
     return render_template(
         "article.html",
-        APP_TITLE=APP_TITLE,
         cu=cu,
         title=article['title'],
         slug=article['slug'],
         content=article['content'],
+        article_id=article_id,
+        discussion_version=discussion_version,
         discussion_topics=topics,
         discussion_replies=replies_map,
+        history_version=history_version,
         article_history=article_history,
-        last_edited=article['last_edited'],
-        LICENSE=LICENSE
+        last_edited=article['last_edited']
     )
 
 # EDIT ARTICLE
 @app.route('/edit_article/<slug>', methods=['GET', 'POST'])
+@limiter.limit("10 per minute", methods=["POST"])
 def edit_article(slug):
     cu = get_user()
     if not cu:
-        flash(f"É necessário fazer logon em uma conta da {APP_TITLE}.", "error")
+        flash(f"É necessário fazer logon em uma conta da {wiki_config['APP_TITLE']}.", "error")
         return redirect(url_for('home'))
 
-    conn = get_db()
-    c = conn.cursor()
-
     # Pega artigo ou cria se não existir
-    c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-    article = c.fetchone()
-    if not article:
-        timestamp = datetime.now().isoformat()
-        c.execute(
-            "INSERT INTO articles (slug, title, content, last_edited) VALUES (?, ?, ?, ?)",
-            (slug, slug, "<p>Artigo criado.</p>", timestamp)
-        )
-        conn.commit()
-        c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-        article = c.fetchone()
+    article = repo.ensure_article(slug, slug, "<p>Artigo criado.</p>")
 
     if request.method == 'POST':
         new_content = request.form.get('content','').strip()
+        # o conteúdo atual já veio com o artigo; comparar direto sai mais barato que hashear os dois
         if new_content == article['content']:
             flash("Nenhuma alteração feita.", "info")
-            conn.close()
             return redirect(url_for('goto', slug=slug))
 
-        timestamp = datetime.now().isoformat()
+        # SALVA VERSÃO NOVA NO HISTÓRICO E ATUALIZA ARTIGO PRINCIPAL
+        repo.update_article(article, new_content, cu['username'])
 
-        # SALVA VERSÃO NOVA NO HISTÓRICO
-        c.execute("""
-            INSERT INTO article_history (slug, content, ts, user)
-            VALUES (?, ?, ?, ?)
-        """, (slug, new_content, timestamp, cu['username']))
-
-        # ATUALIZA ARTIGO PRINCIPAL
-        c.execute("""
-            UPDATE articles
-            SET content=?, last_edited=?, last_editor=?
-            WHERE slug=?
-        """, (new_content, timestamp, cu['username'], slug))
-
-        conn.commit()
-        conn.close()
+        fragment_cache.invalidate("history", article['id'])
         flash("Artigo atualizado e versão salva no histórico!", "success")
         return redirect(url_for('goto', slug=slug))
 
-    conn.close()
     return render_template("edit_article.html",
-        APP_TITLE=APP_TITLE,
         cu=cu,
         title=article['title'],
         content=article['content'],
-        slug=slug,
-        LICENSE=LICENSE
+        slug=slug
+    )
+
+# Move (renomeia) artigo: o histórico segue pelo article_id, sem reescrever nada
+@app.route('/move/<path:slug>', methods=['GET', 'POST'])
+@limiter.limit("10 per minute", methods=["POST"])
+def move_article(slug):
+    cu = get_user()
+    if not cu:
+        flash(f"É necessário fazer logon em uma conta da {wiki_config['APP_TITLE']}.", "error")
+        return redirect(url_for('home'))
+
+    article = repo.get_article(slug)
+    if not article:
+        flash(f"Artigo não encontrado: {slug}", "error")
+        return redirect(url_for('home'))
+
+    if request.method == 'POST':
+        new_slug = request.form.get('new_slug', '').strip()
+        if not new_slug or new_slug == slug:
+            flash("Informe um nome novo para o artigo.", "error")
+            return redirect(url_for('move_article', slug=slug))
+
+        # revisão nula registrando a mudança de nome
+        try:
+            repo.move_article(article, new_slug, cu['username'])
+        except DuplicateError:
+            flash(f"Já existe um artigo chamado {new_slug}.", "error")
+            return redirect(url_for('move_article', slug=slug))
+
+        fragment_cache.invalidate("history", article['id'])
+        flash(f"Artigo movido para {new_slug}.", "success")
+        return redirect(url_for('goto', slug=new_slug))
+
+    return render_template("move.html",
+        cu=cu,
+        title=article['title'],
+        slug=slug
     )
 
 @app.route('/article/<slug>/discussion', methods=['POST'])
@@ -446,27 +1587,15 @@ def add_discussion(slug):
         flash("Mensagem vazia.", "error")
         return redirect(url_for('goto', slug=slug))
 
-    conn = get_db()
-    c = conn.cursor()
-
     # Garante que o artigo existe, cria se for user:<username>
-    c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-    article = c.fetchone()
+    article = repo.get_article(slug)
     if not article:
         # Se for perfil de usuário, cria o "artigo de usuário"
         if slug.startswith("user:"):
             username = slug.split(":",1)[1]
-            timestamp = datetime.now().isoformat()
-            c.execute("""
-                INSERT INTO articles (slug, title, content, last_edited)
-                VALUES (?, ?, ?, ?)
-            """, (slug, f"Perfil de {username}", f"<p>Perfil de {username} criado.</p>", timestamp))
-            conn.commit()
-            c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-            article = c.fetchone()
+            article = repo.ensure_article(slug, f"Perfil de {username}", f"<p>Perfil de {username} criado.</p>")
         else:
             flash("Artigo inexistente.", "error")
-            conn.close()
             return redirect(url_for('home'))
 
     flash("Tópico criado com sucesso!", "success")
@@ -481,26 +1610,18 @@ def reply_discussion(slug, topic_id):
     if not comment_text:
         flash("Resposta vazia.", "error")
         return redirect(url_for('goto', slug=slug))
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT id FROM articles WHERE slug=?", (slug,))
-    art = c.fetchone()
+    art = repo.get_article(slug)
     if not art:
         flash("Artigo inexistente.", "error")
-        conn.close()
         return redirect(url_for('home'))
     # ensure topic exists
-    c.execute("SELECT id, user FROM discussions WHERE id=? AND article_id=? AND parent_id IS NULL", (topic_id, art['id']))
-    topic = c.fetchone()
+    topic = repo.get_topic(art['id'], topic_id)
     if not topic:
         flash("Tópico inexistente.", "error")
-        conn.close()
         return redirect(url_for('goto', slug=slug))
 
-    c.execute("INSERT INTO discussions (article_id, parent_id, topic_title, comment_text, user, reply_to, ts) VALUES (?, ?, ?, ?, ?, ?, ?)",
-              (art['id'], topic_id, None, comment_text, user, reply_to, datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    repo.add_discussion(art['id'], user, comment_text, parent_id=topic_id, reply_to=reply_to)
+    fragment_cache.invalidate("discussion", art['id'])
     flash("Resposta adicionada!", "success")
     return redirect(url_for('goto', slug=slug))
 
@@ -517,30 +1638,12 @@ def add_user_discussion(username):
 
     slug = f"user:{username}"
 
-    conn = get_db()
-    c = conn.cursor()
-
     # garante que o "artigo" de usuário existe
-    c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-    article = c.fetchone()
-    if not article:
-        timestamp = datetime.now().isoformat()
-        c.execute("""
-            INSERT INTO articles (slug, title, content, last_edited)
-            VALUES (?, ?, ?, ?)
-        """, (slug, f"Perfil de {username}", f"<p>Perfil de {username} criado.</p>", timestamp))
-        conn.commit()
-        c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-        article = c.fetchone()
+    article = repo.ensure_article(slug, f"Perfil de {username}", f"<p>Perfil de {username} criado.</p>")
 
     # cria o tópico
-    c.execute("""
-        INSERT INTO discussions (article_id, parent_id, topic_title, comment_text, user, ts)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """, (article['id'], None, topic_title if topic_title else None, comment_text, user, datetime.now().isoformat()))
-
-    conn.commit()
-    conn.close()
+    repo.add_discussion(article['id'], user, comment_text, title=topic_title if topic_title else None)
+    fragment_cache.invalidate("discussion", article['id'])
     flash("Tópico criado com sucesso!", "success")
     return redirect(url_for('user_page', username=username))
 
@@ -557,39 +1660,120 @@ def reply_user_discussion(username, topic_id):
         return redirect(url_for('user_page', username=username))
 
     slug = f"user:{username}"
-    conn = get_db()
-    c = conn.cursor()
-
     # pega artigo de usuário
-    c.execute("SELECT id FROM articles WHERE slug=?", (slug,))
-    art = c.fetchone()
+    art = repo.get_article(slug)
     if not art:
         flash("Perfil inexistente.", "error")
-        conn.close()
         return redirect(url_for('home'))
 
     # garante que o tópico existe
-    c.execute("SELECT id, user FROM discussions WHERE id=? AND article_id=? AND parent_id IS NULL", (topic_id, art['id']))
-    topic = c.fetchone()
+    topic = repo.get_topic(art['id'], topic_id)
     if not topic:
         flash("Tópico inexistente.", "error")
-        conn.close()
         return redirect(url_for('user_page', username=username))
 
     # insere reply
-    c.execute("""
-        INSERT INTO discussions (article_id, parent_id, topic_title, comment_text, user, reply_to, ts)
-        VALUES (?, ?, ?, ?, ?, ?, ?)
-    """, (art['id'], topic_id, None, comment_text, user, reply_to, datetime.now().isoformat()))
-
-    conn.commit()
-    conn.close()
+    repo.add_discussion(art['id'], user, comment_text, parent_id=topic_id, reply_to=reply_to)
+    fragment_cache.invalidate("discussion", art['id'])
     flash("Resposta adicionada!", "success")
     return redirect(url_for('user_page', username=username))
 
+# ---------- SENHAS ----------
+# scrypt/pbkdf2 são caros de propósito; rodam num pool pequeno com fila limitada
+# pra uma rajada de logins não roubar CPU das páginas. Fila cheia = recusa na hora.
+DEFAULT_PASSWORD_HASH_METHOD = "scrypt:32768:8:1"
+PASSWORD_POOL_WORKERS = 2
+PASSWORD_QUEUE_LIMIT = 16   # hashes em execução + esperando
+PASSWORD_TIMEOUT = 10       # segundos esperando um hash antes de desistir
+PASSWORD_METRICS_SAMPLES = 1000
+
+class PasswordPoolBusy(Exception):
+    pass
+
+class PasswordHasher:
+    """Pool limitado pra gerar e checar hashes de senha, com métricas de latência."""
+
+    def __init__(self, workers=PASSWORD_POOL_WORKERS, queue_limit=PASSWORD_QUEUE_LIMIT):
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self.slots = threading.BoundedSemaphore(queue_limit)
+        self.lock = threading.Lock()
+        self.samples = {"check": deque(maxlen=PASSWORD_METRICS_SAMPLES), "generate": deque(maxlen=PASSWORD_METRICS_SAMPLES)}
+        self.rejected = 0
+        self.prefixes = {}  # método do config -> prefixo que ele gera no hash
+
+    @property
+    def method(self):
+        # vem do config.json, então trocar o custo não precisa de deploy
+        return wiki_config.get("PASSWORD_HASH_METHOD", DEFAULT_PASSWORD_HASH_METHOD)
+
+    def _run(self, op, fn, *args):
+        if not self.slots.acquire(blocking=False):
+            with self.lock:
+                self.rejected += 1
+            raise PasswordPoolBusy()
+        start = time.monotonic()
+        # o slot só volta quando o hash termina de verdade, mesmo se quem pediu desistiu
+        future = self.executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        try:
+            return future.result(timeout=PASSWORD_TIMEOUT)
+        except FutureTimeoutError:
+            with self.lock:
+                self.rejected += 1
+            raise PasswordPoolBusy()
+        finally:
+            with self.lock:
+                self.samples[op].append(time.monotonic() - start)
+
+    def generate(self, password):
+        return self._run("generate", generate_password_hash, password, self.method)
+
+    def check(self, stored, password):
+        return self._run("check", check_password_hash, stored, password)
+
+    def method_prefix(self, method):
+        # o werkzeug completa o método (pbkdf2:sha256 -> pbkdf2:sha256:1000000,
+        # scrypt -> scrypt:32768:8:1), então o prefixo sai de um hash de verdade
+        with self.lock:
+            prefix = self.prefixes.get(method)
+        if prefix is None:
+            prefix = generate_password_hash("", method).split("$", 1)[0]
+            with self.lock:
+                self.prefixes[method] = prefix
+        return prefix
+
+    def needs_rehash(self, stored):
+        return stored.split("$", 1)[0] != self.method_prefix(self.method)
+
+    def metrics(self):
+        with self.lock:
+            result = {"rejected": self.rejected}
+            for op, samples in self.samples.items():
+                ordered = sorted(samples)
+                if not ordered:
+                    result[op] = {"count": 0}
+                    continue
+                result[op] = {
+                    "count": len(ordered),
+                    "p50_ms": round(ordered[len(ordered) // 2] * 1000, 1),
+                    "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                    "max_ms": round(ordered[-1] * 1000, 1)
+                }
+            return result
+
+password_hasher = PasswordHasher()
+
+@app.route('/admin/metrics/auth')
+def auth_metrics():
+    cu = get_user()
+    if not cu or not cu['is_admin']:
+        return jsonify({"error": "forbidden"}), 403
+    return jsonify(password_hasher.metrics())
+
 # ---------- AUTH ----------
 # Registro seguro
 @app.route('/register', methods=['GET','POST'])
+@limiter.limit("5 per hour", methods=["POST"])
 def register():
     if request.method == 'POST':
         username = request.form.get('username','').strip()
@@ -598,21 +1782,20 @@ def register():
             flash("Preenche aí.", "error")
             return redirect(url_for('register'))
 
-        hashed = generate_password_hash(password)  # hash da senha
+        try:
+            hashed = password_hasher.generate(password)  # hash da senha
+        except PasswordPoolBusy:
+            flash("Servidor ocupado, tente de novo em instantes.", "error")
+            return render_template("register.html"), 503
 
-        conn = get_db()
-        c = conn.cursor()
         try:
-            c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed))
-            conn.commit()
+            repo.create_user(username, hashed)
             flash("Conta criada! Faz login.", "success")
-            conn.close()
             return redirect(url_for('login'))
-        except sqlite3.IntegrityError:
-            conn.close()
+        except DuplicateError:
             flash("Usuário já existe.", "error")
 
-    return render_template("register.html", APP_TITLE=APP_TITLE, LICENSE=LICENSE)
+    return render_template("register.html")
 
 
 # Login seguro
@@ -622,20 +1805,30 @@ def login():
         username = request.form.get('username','').strip()
         password = request.form.get('password','').strip()
 
-        conn = get_db()
-        c = conn.cursor()
-        c.execute("SELECT * FROM users WHERE username=?", (username,))
-        u = c.fetchone()
-        conn.close()
+        u = repo.get_user(username)
 
-        if u and check_password_hash(u['password'], password):
+        try:
+            ok = bool(u) and password_hasher.check(u['password'], password)
+        except PasswordPoolBusy:
+            flash("Servidor ocupado, tente de novo em instantes.", "error")
+            return render_template("login.html"), 503
+
+        # parâmetros do hash mudaram: aproveita a senha em texto e regrava;
+        # se o pool estiver cheio fica pro próximo login
+        if ok and password_hasher.needs_rehash(u['password']):
+            try:
+                repo.set_password(u['id'], password_hasher.generate(password))
+            except PasswordPoolBusy:
+                pass
+
+        if ok:
             session['username'] = u['username']
             flash("Logado!", "success")
             return redirect(url_for('home'))
         else:
             flash("Credenciais inválidas!", "error")
 
-    return render_template("login.html", APP_TITLE=APP_TITLE, LICENSE=LICENSE)
+    return render_template("login.html")
 
 @app.route('/logout')
 def logout():
@@ -645,59 +1838,45 @@ def logout():
 
 # ---------- SEARCH ----------
 @app.route('/search')
+@limiter.limit("20 per minute")
 def search():
     q = request.args.get('q','').strip()
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT * FROM articles WHERE title LIKE ? OR content LIKE ? LIMIT 50", ('%'+q+'%','%'+q+'%'))
-    results = c.fetchall()
-    conn.close()
-    return render_template("search.html", APP_TITLE=APP_TITLE, cu=get_user(), title=f"Busca: {q}", q=q, results=results, LICENSE=LICENSE)
+    results = repo.search_articles(q)
+    return render_template("search.html", cu=get_user(), title=f"Busca: {q}", q=q, results=results)
 
 # ---------- STUBS / PAGES ----------
 @app.route('/base')
 def base():
-    return render_template("base.html", LICENSE=LICENSE)
+    return render_template("base.html")
 
 @app.route('/ajuda')
 def ajuda():
-    return render_template("simple.html", APP_TITLE=APP_TITLE, cu=get_user(), title="Ajuda", heading="Ajuda", text="Página de ajuda (stub).", LICENSE=LICENSE)
+    return render_template("simple.html", cu=get_user(), title="Ajuda", heading="Ajuda", text="Página de ajuda (stub).")
 
 @app.route('/about')
 def about():
-    return render_template("simple.html", APP_TITLE=APP_TITLE, cu=get_user(), title="Sobre", heading="Sobre", text="Sobre o projeto Lusopédia (stub).", LICENSE=LICENSE)
+    return render_template("simple.html", cu=get_user(), title="Sobre", heading="Sobre", text="Sobre o projeto Lusopédia (stub).")
 
 @app.route('/portal')
 def portal():
-    return render_template("simple.html", APP_TITLE=APP_TITLE, cu=get_user(), title="Portal", heading="Portal", text="Portal (stub).", LICENSE=LICENSE)
+    return render_template("simple.html", cu=get_user(), title="Portal", heading="Portal", text="Portal (stub).")
 
 @app.route('/afluentes/<path:slug>')
 def afluentes(slug):
-    return render_template("simple.html", APP_TITLE=APP_TITLE, cu=get_user(), title="Afluentes", heading=f"Afluentes de {slug}", text="Lista de afluentes (stub).", LICENSE=LICENSE)
+    return render_template("simple.html", cu=get_user(), title="Afluentes", heading=f"Afluentes de {slug}", text="Lista de afluentes (stub).")
 
 @app.route('/recent_changes')
 def recent_changes():
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("""
-        SELECT a.title, h.ts, h.user
-        FROM article_history h
-        JOIN articles a ON a.slug = h.slug
-        ORDER BY h.ts DESC
-        LIMIT 50
-    """)
-    changes = c.fetchall()
-    conn.close()
+    changes = repo.recent_changes()
     return render_template(
         "recent.html",
-        APP_TITLE=APP_TITLE,
         cu=get_user(),
         title="Alterações recentes",
-        changes=changes,
-        LICENSE=LICENSE
+        changes=changes
     )
 
 @app.route('/Upload', methods=['GET', 'POST'])
+@limiter.limit("5 per minute", methods=["POST"])
 def Upload():
     if request.method == 'POST':
         uploaded = request.files.get('file')
@@ -740,28 +1919,22 @@ def Upload():
 
     return render_template(
         "upload.html",
-        APP_TITLE=APP_TITLE,
         cu=get_user(),
-        title="Carregar ficheiro",
-        LICENSE=LICENSE
+        title="Carregar ficheiro"
     )
 
 @app.route('/PagEspecial')
 def PagEspecial():
-    return render_template("simple.html", APP_TITLE=APP_TITLE, cu=get_user(), title="Páginas especiais", heading="Páginas especiais", text="Lista de páginas especiais (stub).", LICENSE=LICENSE)
+    return render_template("simple.html", cu=get_user(), title="Páginas especiais", heading="Páginas especiais", text="Lista de páginas especiais (stub).")
 
 @app.route('/profile/<username>')
 def profile(username):
     cu = get_user()
     slug = f"user:{username}"
 
-    conn = get_db()
-    c = conn.cursor()
-
-    c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-    article = c.fetchone()
+    article = repo.get_article(slug)
 
-    return render_template("user.html", APP_TITLE=APP_TITLE, cu=get_user(), title=f"Perfil de {username}", heading=f"Perfil: {username}", text="Página de perfil (stub).", LICENSE=LICENSE, article=article, username=cu['username'])
+    return render_template("user.html", cu=get_user(), title=f"Perfil de {username}", heading=f"Perfil: {username}", text="Página de perfil (stub).", article=article, username=cu['username'])
 
 @app.route('/user/<username>', methods=['GET', 'POST'])
 def user_page(username):
@@ -770,21 +1943,8 @@ def user_page(username):
 
     owner_name = slug.split(':',1)[1]
 
-    conn = get_db()
-    c = conn.cursor()
-
     # Pega ou cria o "artigo de usuário"
-    c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-    article = c.fetchone()
-    if not article:
-        timestamp = datetime.now().isoformat()
-        c.execute(
-            "INSERT INTO articles (slug, title, content, last_edited) VALUES (?, ?, ?, ?)",
-            (slug, f"Perfil de {username}", f"<p>Perfil de {username} criado.</p>", timestamp)
-        )
-        conn.commit()
-        c.execute("SELECT * FROM articles WHERE slug=?", (slug,))
-        article = c.fetchone()
+    article = repo.ensure_article(slug, f"Perfil de {username}", f"<p>Perfil de {username} criado.</p>")
 
     # verifica se o usuário logado é o dono do perfil
     is_owner = cu and cu['username'] == owner_name
@@ -793,170 +1953,900 @@ def user_page(username):
     if request.method == 'POST':
         if not is_owner:
             flash("Você não pode editar o perfil de outro usuário.", "error")
-            conn.close()
             return redirect(url_for('user_page', username=username))
 
         new_content = request.form.get('content', '').strip()
         if new_content and new_content != article['content']:
-            timestamp = datetime.now().isoformat()
-            # salva versão antiga no histórico
-            c.execute(
-                "INSERT INTO article_history (slug, content, ts, user) VALUES (?, ?, ?, ?)",
-                (slug, article['content'], timestamp, cu['username'])
-            )
-            # atualiza artigo
-            c.execute(
-                "UPDATE articles SET content=?, last_edited=?, last_editor=? WHERE slug=?",
-                (new_content, timestamp, cu['username'], slug)
-            )
-            conn.commit()
+            # salva a versão nova no histórico e atualiza artigo
+            repo.update_article(article, new_content, cu['username'])
+            fragment_cache.invalidate("history", article['id'])
             flash("Perfil atualizado com sucesso!", "success")
 
-        conn.close()
         return redirect(url_for('user_page', username=username))
 
-    # discussions principais (parent_id IS NULL)
-    c.execute("SELECT * FROM discussions WHERE article_id=? AND parent_id IS NULL ORDER BY ts DESC", (article['id'],))
-    discussion_topics = c.fetchall()
-
-    # replies (parent_id NOT NULL)
-    c.execute("SELECT * FROM discussions WHERE article_id=? AND parent_id IS NOT NULL ORDER BY ts ASC", (article['id'],))
-    replies = c.fetchall()
-    discussion_replies = {}
-    for r in replies:
-        discussion_replies.setdefault(r['parent_id'], []).append(r)
-
-    conn.close()
+    # discussions principais (parent_id IS NULL) e replies
+    discussion_version, discussion_topics, discussion_replies = repo.discussions(article['id'])
 
     return render_template(
         'user.html',
-        APP_TITLE=APP_TITLE,
         cu=cu,
         username=owner_name,
         article=article,
         slug=slug,
+        article_id=article['id'],
+        discussion_version=discussion_version,
         discussion_topics=discussion_topics,
         discussion_replies=discussion_replies,
-        is_owner=is_owner,  # passa para o template controlar o form
-        LICENSE=LICENSE
+        is_owner=is_owner  # passa para o template controlar o form
     )
 
 # Contribuições
+CONTRIBS_PAGE_SIZE = 50
+
 @app.route('/contributions/<username>')
 def contributions(username):
-    conn = get_db()
-    conn.row_factory = sqlite3.Row
-    c = conn.cursor()
+    # paginação por keyset: ?before=<id> pega as edições mais antigas que esse id
+    before = request.args.get('before', type=int)
+    stats = repo.user_stats(username)
 
-    # Puxa as edições feitas pelo usuário
-    c.execute("""
-        SELECT 
-            h.id,
-            h.slug,
-            h.ts,
-            h.user,
-            a.title
-        FROM article_history h
-        LEFT JOIN articles a ON a.slug = h.slug
-        WHERE h.user = ?
-        ORDER BY h.ts DESC
-        LIMIT 200
-    """, (username,))
-
-    contribs = c.fetchall()
-    conn.close()
+    # Puxa as edições feitas pelo usuário (uma a mais pra saber se tem próxima página)
+    contribs = repo.contributions(username, before, CONTRIBS_PAGE_SIZE + 1)
+
+    next_before = None
+    if len(contribs) > CONTRIBS_PAGE_SIZE:
+        contribs = contribs[:CONTRIBS_PAGE_SIZE]
+        next_before = contribs[-1]['id']
 
     return render_template(
         "contribs.html",
-        APP_TITLE=APP_TITLE,
         cu=get_user(),
         title=f"Contribuições de {username}",
+        username=username,
+        stats=stats,
         contribs=contribs,
-        LICENSE=LICENSE
+        is_first_page=before is None,
+        next_before=next_before
     )
 
 # Mostra histórico do artigo
 @app.route('/history/<path:slug>')
 def history(slug):
-    db = sqlite3.connect(' DB_FILE')
-    db.row_factory = sqlite3.Row
-    cur = db.execute(
-        "SELECT id, content, ts, user, summary FROM article_history WHERE slug = ? ORDER BY ts DESC",
-        (slug,)
-    )
-    article_history = cur.fetchall()  # renomeado pra bater com o template
-    db.close()
-
-    # Pega título do artigo pra mostrar no cabeçalho
-    conn = get_db()
-    c = conn.cursor()
-    c.execute("SELECT title FROM articles WHERE slug=?", (slug,))
-    article = c.fetchone()
-    conn.close()
+    # Pega o artigo pra mostrar o título e achar o histórico pelo id
+    article = repo.get_article(slug)
+    if article:
+        history_version, article_history = repo.history(article['id'])
+    else:
+        history_version, article_history = 0, []
     title = article['title'] if article else slug
 
     return render_template("article.html",
                            slug=slug,
                            title=title,
-                           article_history=article_history,
-                           LICENSE=LICENSE)
+                           article_id=article['id'] if article else None,
+                           history_version=history_version,
+                           article_history=article_history)
 
 # Mostra uma versão específica
 @app.route('/history/<path:slug>/<int:version_id>')
 def view_version(slug, version_id):
     cu = get_user()
-    conn = get_db()
-    conn.row_factory = sqlite3.Row
-    cur = conn.cursor()
 
     # Pega a versão exata
-    cur.execute("SELECT * FROM article_history WHERE id = ?", (version_id,))
-    version = cur.fetchone()
+    version = repo.revision(version_id)
     if not version:
-        conn.close()
         flash("Versão não encontrada.", "error")
         return redirect(url_for('goto', slug=slug))
 
     # Pega o título do artigo
-    cur.execute("SELECT title FROM articles WHERE slug=?", (slug,))
-    article = cur.fetchone()
+    article = repo.get_article_by_id(version['article_id'])
     title = article['title'] if article else slug
 
     # Opcional: pegar histórico completo pra mostrar na tabela
-    cur.execute("SELECT id, ts, user FROM article_history WHERE slug=? ORDER BY ts DESC", (slug,))
-    article_history = cur.fetchall()
-
-    conn.close()
+    article_history = repo.revision_list(version['article_id'])
 
     return render_template(
         "version.html",
-        APP_TITLE=APP_TITLE,
         cu=cu,
         title=title,
         slug=slug,
         version=version,
-        article_history=article_history,
-        LICENSE=LICENSE
+        article_history=article_history
+    )
+
+# Compara duas versões
+@app.route('/history/<path:slug>/diff/<int:old_id>/<int:new_id>')
+def diff_versions(slug, old_id, new_id):
+    article = repo.get_article(slug)
+    # só revisões deste artigo; id de outra página dá o mesmo erro de id inexistente
+    found = {row['id']: dict(row) for row in repo.revisions((old_id, new_id))
+             if article and row['article_id'] == article['id']}
+    try:
+        if old_id not in found or new_id not in found:
+            raise LookupError("Versão não encontrada.")
+        rows, added, removed = revision_diff(repo.name, revision_key(found[old_id]), revision_key(found[new_id]))
+    except LookupError as e:
+        flash(str(e), "error")
+        return redirect(url_for('goto', slug=slug))
+    diff = {"old": found[old_id], "new": found[new_id], "rows": rows, "added": added, "removed": removed}
+
+    return render_template(
+        "diff.html",
+        cu=get_user(),
+        title=slug,
+        slug=slug,
+        diff=diff
     )
 
 @app.route('/privacy')
 def privacy():
-    return render_template("simple.html", APP_TITLE=APP_TITLE, cu=get_user(), title="Privacidade", heading="Política de privacidade", text="Política de privacidade (stub).", LICENSE=LICENSE)
+    return render_template("simple.html", cu=get_user(), title="Privacidade", heading="Política de privacidade", text="Política de privacidade (stub).")
 
 @app.route('/terms')
 def terms():
-    return render_template("simple.html", APP_TITLE=APP_TITLE, cu=get_user(), title="Termos", heading="Termos de uso", text="Termos (stub).", LICENSE=LICENSE)
+    return render_template("simple.html", cu=get_user(), title="Termos", heading="Termos de uso", text="Termos (stub).")
 
 @app.route('/cookie_statement')
 def cookie_statement():
-    return render_template("simple.html", APP_TITLE=APP_TITLE, cu=get_user(), title="Cookies", heading="Cookies", text="Política de cookies (stub).", LICENSE=LICENSE)
+    return render_template("simple.html", cu=get_user(), title="Cookies", heading="Cookies", text="Política de cookies (stub).")
 
 # serve uploads
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     return send_from_directory(UPLOAD_FOLDER, filename)
 
+# ---------- REVERSÃO EM MASSA ----------
+@app.route('/admin/rollback/<username>', methods=['GET', 'POST'])
+def admin_rollback(username):
+    cu = get_user()
+    if not cu or not cu['is_admin']:
+        flash("Apenas o admin pode reverter edições em massa.", "error")
+        return redirect(url_for('home'))
+    if username == cu['username']:
+        flash("Não dá pra reverter as próprias edições em massa.", "error")
+        return redirect(url_for('contributions', username=username))
+
+    if request.method == 'POST':
+        start = time.monotonic()
+        restored, skipped = repo.rollback_user_edits(
+            username, cu['username'],
+            progress=lambda done, total: app.logger.info("rollback de %s: %d/%d páginas", username, done, total)
+        )
+        flash(f"{restored} páginas revertidas, {skipped} ignoradas (criadas por {username}) "
+              f"em {time.monotonic() - start:.1f}s.", "success")
+        return redirect(url_for('contributions', username=username))
+
+    targets = repo.rollback_targets(username)
+    return render_template(
+        "rollback.html",
+        cu=cu,
+        title=f"Reverter edições de {username}",
+        username=username,
+        targets=targets,
+        restorable=sum(1 for t in targets if t['good_id'] is not None)
+    )
+
+@app.cli.command("rollback-user")
+@click.argument("username")
+@click.option("--by", default="admin", show_default=True, help="Usuário que assina as reversões.")
+@click.option("--chunk-size", default=ROLLBACK_CHUNK_SIZE, show_default=True, help="Artigos por transação.")
+def rollback_user_command(username, by, chunk_size):
+    """Reverte todas as páginas em que USERNAME fez a última edição."""
+    start = time.monotonic()
+    restored, skipped = repo.rollback_user_edits(
+        username, by, chunk_size,
+        lambda done, total: click.echo(f"{done}/{total} páginas")
+    )
+    click.echo(f"{restored} páginas revertidas, {skipped} ignoradas (criadas por {username}) "
+               f"em {time.monotonic() - start:.1f}s.")
+
+# ---------- BACKUP ----------
+# snapshot online com a API de backup do sqlite: copia BACKUP_PAGES_PER_STEP
+# páginas por vez e dorme BACKUP_STEP_SLEEP entre os passos, então não segura os writers
+BACKUP_FOLDER = "backups"
+BACKUP_LOG = os.path.join(BACKUP_FOLDER, "backups.jsonl")
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.005  # segundos entre passos (via callback de progresso)
+BACKUP_COMPRESSIONS = ("gzip", "zstd")
+
+def backup_pause(sleep):
+    # o sqlite3 só usa o `sleep` do backup() quando o banco está BUSY/LOCKED;
+    # a pausa entre passos, que deixa os writers entrarem, fica no progress
+    def progress(status, remaining, total):
+        if remaining and sleep:
+            time.sleep(sleep)
+    return progress
+
+def check_integrity(conn):
+    result = conn.execute("PRAGMA integrity_check").fetchone()[0]
+    if result != "ok":
+        raise RuntimeError(f"Snapshot corrompido: {result}")
+
+def compress_file(path, compression):
+    if compression == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Compressão zstd precisa do pacote 'zstandard'.")
+        out_path = path + ".zst"
+    else:
+        out_path = path + ".gz"
+    try:
+        if compression == "zstd":
+            with open(path, "rb") as src, open(out_path, "wb") as dst:
+                zstandard.ZstdCompressor().copy_stream(src, dst)
+        else:
+            with open(path, "rb") as src, gzip.open(out_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+    except BaseException:
+        # não deixa arquivo comprimido pela metade com cara de backup
+        if os.path.exists(out_path):
+            os.remove(out_path)
+        raise
+    os.remove(path)
+    return out_path
+
+def decompress_file(path, out_path):
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise RuntimeError("Descompressão zstd precisa do pacote 'zstandard'.")
+        with open(path, "rb") as src, open(out_path, "wb") as dst:
+            zstandard.ZstdDecompressor().copy_stream(src, dst)
+    else:
+        with gzip.open(path, "rb") as src, open(out_path, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+
+def backup_db(dest_dir=BACKUP_FOLDER, compression=None, pages=BACKUP_PAGES_PER_STEP, sleep=BACKUP_STEP_SLEEP):
+    """Gera um snapshot consistente do DB_FILE, checa a integridade e registra no log.
+
+    Retorna o registro gravado em BACKUP_LOG (path, bytes, seconds, ts).
+    """
+    if compression and compression not in BACKUP_COMPRESSIONS:
+        raise ValueError(f"Compressão desconhecida: {compression}")
+    if compression == "zstd" and zstandard is None:
+        # checa antes de copiar o banco inteiro à toa
+        raise RuntimeError("Compressão zstd precisa do pacote 'zstandard'.")
+    require_sqlite("backup-db")
+    os.makedirs(dest_dir, exist_ok=True)
+    name = os.path.splitext(os.path.basename(wiki_config["DB_FILE"]))[0]
+    path = os.path.join(dest_dir, f"{name}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db")
+
+    start = time.monotonic()
+    src = get_db()
+    dst = sqlite3.connect(path)
+    try:
+        src.backup(dst, pages=pages, progress=backup_pause(sleep))
+        check_integrity(dst)
+    except Exception:
+        dst.close()
+        os.remove(path)
+        raise
+    finally:
+        src.close()
+    dst.close()
+
+    if compression:
+        try:
+            path = compress_file(path, compression)
+        except BaseException:
+            os.remove(path)
+            raise
+
+    record = {
+        "ts": datetime.now().isoformat(),
+        "path": path,
+        "bytes": os.path.getsize(path),
+        "seconds": round(time.monotonic() - start, 3)
+    }
+    # log único mesmo com --dest, senão o backup não aparece no /admin/backup
+    os.makedirs(os.path.dirname(BACKUP_LOG), exist_ok=True)
+    with open(BACKUP_LOG, "a", encoding="utf-8") as f:
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return record
+
+def restore_db(path, pages=BACKUP_PAGES_PER_STEP):
+    """Restaura um snapshot (opcionalmente .gz/.zst) por cima do DB_FILE.
+
+    O snapshot é checado antes e copiado com a API de backup, que respeita os
+    locks do sqlite em vez de sobrescrever o arquivo com a app rodando.
+    """
+    require_sqlite("restore-db")
+    tmp_path = None
+    if path.endswith((".gz", ".zst")):
+        fd, tmp_path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        decompress_file(path, tmp_path)
+    try:
+        src = sqlite3.connect(tmp_path or path)
+        try:
+            check_integrity(src)
+            dst = get_db()
+            try:
+                src.backup(dst, pages=pages, progress=backup_pause(BACKUP_STEP_SLEEP))
+            finally:
+                dst.close()
+        finally:
+            src.close()
+    finally:
+        if tmp_path:
+            os.remove(tmp_path)
+
+def read_backup_log(limit=20):
+    if not os.path.exists(BACKUP_LOG):
+        return []
+    with open(BACKUP_LOG, "r", encoding="utf-8") as f:
+        lines = f.readlines()[-limit:]
+    return [json.loads(line) for line in reversed(lines) if line.strip()]
+
+@app.route('/admin/backup', methods=['GET', 'POST'])
+def admin_backup():
+    cu = get_user()
+    if not cu or not cu['is_admin']:
+        flash("Apenas o admin pode fazer backups.", "error")
+        return redirect(url_for('home'))
+    if DB_BACKEND != "sqlite":
+        flash(f"Backups só funcionam com DB_BACKEND=sqlite (atual: {DB_BACKEND}).", "error")
+        return redirect(url_for('home'))
+
+    if request.method == 'POST':
+        compression = request.form.get('compression', '').strip() or None
+        try:
+            record = backup_db(compression=compression)
+        except (RuntimeError, ValueError, sqlite3.Error) as e:
+            flash(f"Falha no backup: {e}", "error")
+        else:
+            flash(f"Backup salvo em {record['path']} ({record['bytes']} bytes, {record['seconds']}s).", "success")
+        return redirect(url_for('admin_backup'))
+
+    return render_template("backup.html", cu=cu, title="Backups", backups=read_backup_log())
+
+@app.cli.command("backup-db")
+@click.option("--dest", default=BACKUP_FOLDER, show_default=True, help="Pasta dos snapshots.")
+@click.option("--compress", "compression", type=click.Choice(BACKUP_COMPRESSIONS), help="Comprime o snapshot.")
+@click.option("--pages", default=BACKUP_PAGES_PER_STEP, show_default=True, help="Páginas copiadas por passo.")
+def backup_db_command(dest, compression, pages):
+    """Faz um snapshot online do banco com a API de backup do sqlite."""
+    record = backup_db(dest, compression, pages)
+    click.echo(f"{record['path']}: {record['bytes']} bytes em {record['seconds']}s")
+
+@app.cli.command("restore-db")
+@click.argument("path")
+def restore_db_command(path):
+    """Restaura um snapshot gerado por backup-db."""
+    start = time.monotonic()
+    restore_db(path)
+    click.echo(f"{path} restaurado em {wiki_config['DB_FILE']} ({time.monotonic() - start:.3f}s)")
+
+# ---------- IMPORT / EXPORT ----------
+# dumps do MediaWiki (XML) e JSONL (uma página por linha), sempre em streaming
+MW_EXPORT_NS = "http://www.mediawiki.org/xml/export-0.10/"
+IMPORT_BATCH_SIZE = 1000    # revisões por executemany
+IMPORT_COMMIT_PAGES = 5000  # páginas por transação
+BACKFILL_BATCH_SIZE = 500   # revisões por transação no backfill-history
+
+def open_dump(path, mode):
+    # aceita dumps comprimidos como os que o MediaWiki publica
+    if path.endswith(".bz2"):
+        return bz2.open(path, mode)
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+    return open(path, mode)
+
+def mw_timestamp(ts):
+    # o MediaWiki usa "2024-01-31T12:00:00Z" (UTC); a app grava isoformat() local, sem fuso
+    if ts and ts.endswith("Z"):
+        try:
+            utc = datetime.fromisoformat(ts[:-1]).replace(tzinfo=timezone.utc)
+        except ValueError:
+            return ts[:-1]
+        return utc.astimezone().replace(tzinfo=None).isoformat()
+    return ts
+
+def mw_export_timestamp(ts):
+    # caminho inverso: hora local da app -> UTC com "Z"; se não der pra ler, sai sem fuso
+    try:
+        return datetime.fromisoformat(ts).astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    except ValueError:
+        return ts
+
+def iter_mediawiki_revisions(f):
+    """Lê um dump XML do MediaWiki com iterparse, em memória constante.
+
+    Gera uma revisão por vez, na ordem do dump, como dict com slug, title,
+    ts, user, summary e content. Cada <revision> é liberada logo após lida
+    e a árvore é limpa no fim de cada <page>.
+    """
+    context = ET.iterparse(f, events=("start", "end"))
+    _, root = next(context)
+    title = None
+    rev = None
+    for event, elem in context:
+        tag = elem.tag.rsplit("}", 1)[-1]
+        if event == "start":
+            if tag == "revision":
+                rev = {"slug": title, "title": title, "ts": None, "user": None, "summary": None, "content": ""}
+            continue
+
+        if rev is None:
+            if tag == "title":
+                title = elem.text
+            elif tag == "page":
+                root.clear()
+            continue
+
+        if tag == "timestamp":
+            rev["ts"] = mw_timestamp(elem.text)
+        elif tag in ("username", "ip"):
+            rev["user"] = elem.text
+        elif tag == "comment":
+            rev["summary"] = elem.text
+        elif tag == "text":
+            rev["content"] = elem.text or ""
+        elif tag == "revision":
+            yield rev
+            rev = None
+            elem.clear()
+
+def iter_jsonl_revisions(f):
+    """Lê o formato JSONL gerado por export-wiki: uma página por linha."""
+    for line in f:
+        if not line.strip():
+            continue
+        page = json.loads(line)
+        slug = page.get("slug") or page["title"]
+        for r in page.get("revisions", []):
+            yield {
+                "slug": slug,
+                "title": page.get("title") or slug,
+                "ts": r.get("ts"),
+                "user": r.get("user"),
+                "summary": r.get("summary"),
+                "content": r.get("content") or ""
+            }
+
+def import_revisions(conn, revisions, batch_size=IMPORT_BATCH_SIZE, commit_pages=IMPORT_COMMIT_PAGES, progress=None):
+    """Grava revisões (agrupadas por página, em ordem) no histórico e nos artigos.
+
+    O histórico vai em executemany de batch_size linhas; cada página com
+    revisão nova vira um upsert em articles com a última revisão. Faz commit a
+    cada commit_pages páginas e chama progress(pages, revs) nesses pontos.
+    Revisões que já estão no artigo (mesmo ts e hash) são puladas, então dá pra
+    repetir o import depois de uma falha no meio. Devolve (páginas, revisões novas).
+    """
+    c = conn.cursor()
+    c.execute("SELECT COALESCE(MAX(id), 0) FROM article_history")
+    linked_id = c.fetchone()[0]
+    history_batch = []
+    article_batch = []
+    pages = revs = 0
+    current = None
+    article_id = None
+    prev_size = None
+    existing = set()
+    page_changed = False
+
+    def link_parents():
+        # executemany não devolve ids, então o pai das revisões novas é ligado
+        # numa passada só a cada commit; o que já foi commitado sai completo
+        nonlocal linked_id
+        c.execute("""
+            UPDATE article_history
+            SET parent_rev_id = (
+                SELECT MAX(p.id) FROM article_history p
+                WHERE p.article_id = article_history.article_id AND p.id < article_history.id
+            )
+            WHERE id > ?
+        """, (linked_id,))
+        c.execute("SELECT COALESCE(MAX(id), 0) FROM article_history")
+        linked_id = c.fetchone()[0]
+
+    def flush():
+        if history_batch:
+            c.executemany("""
+                INSERT INTO article_history (article_id, slug, content, ts, user, summary, size, size_delta, content_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, history_batch)
+            history_batch.clear()
+        if article_batch:
+            c.executemany("""
+                INSERT INTO articles (slug, title, content, last_edited, last_editor)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(slug) DO UPDATE SET
+                    content=excluded.content,
+                    last_edited=excluded.last_edited,
+                    last_editor=excluded.last_editor
+            """, article_batch)
+            article_batch.clear()
+
+    def finish_page(rev):
+        nonlocal pages
+        if page_changed:
+            article_batch.append((rev["slug"], rev["title"], rev["content"], rev["ts"], rev["user"]))
+        pages += 1
+        if pages % commit_pages == 0:
+            flush()
+            link_parents()
+            conn.commit()
+            if progress:
+                progress(pages, revs)
+
+    for rev in revisions:
+        if not rev["slug"]:
+            continue
+        if current is None or rev["slug"] != current["slug"]:
+            if current is not None:
+                finish_page(current)
+            # o artigo precisa existir antes das revisões pra elas terem article_id
+            c.execute("""
+                INSERT INTO articles (slug, title, content, last_edited, last_editor)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(slug) DO NOTHING
+            """, (rev["slug"], rev["title"], rev["content"], rev["ts"], rev["user"]))
+            c.execute("SELECT id FROM articles WHERE slug=?", (rev["slug"],))
+            article_id = c.fetchone()[0]
+            parent = last_revision(c, article_id)
+            prev_size = parent['size'] if parent else 0
+            c.execute("SELECT ts, content_hash FROM article_history WHERE article_id=?", (article_id,))
+            existing = {(row[0], row[1]) for row in c.fetchall()}
+            page_changed = False
+        size = len(rev["content"].encode("utf-8"))
+        size_delta = size - prev_size if prev_size is not None else None
+        prev_size = size
+        digest = content_hash(rev["content"])
+        current = rev
+        if (rev["ts"], digest) in existing:
+            continue
+        existing.add((rev["ts"], digest))
+        page_changed = True
+        history_batch.append((
+            article_id, rev["slug"], rev["content"], rev["ts"] or datetime.now().isoformat(), rev["user"], rev["summary"],
+            size, size_delta, digest
+        ))
+        revs += 1
+        if len(history_batch) >= batch_size:
+            flush()
+
+    if current is not None:
+        finish_page(current)
+    flush()
+    link_parents()
+    conn.commit()
+    return pages, revs
+
+def backfill_history(conn, batch_size=BACKFILL_BATCH_SIZE, progress=None):
+    """Preenche size, size_delta, content_hash e parent_rev_id das revisões antigas.
+
+    Anda pelo histórico em ordem de id, batch_size linhas por transação, então
+    o pai de cada revisão já está preenchido quando ela é processada.
+    """
+    c = conn.cursor()
+    last_id = 0
+    done = 0
+    while True:
+        c.execute(
+            "SELECT id, article_id, content FROM article_history WHERE id > ? AND size IS NULL ORDER BY id LIMIT ?",
+            (last_id, batch_size)
+        )
+        rows = c.fetchall()
+        if not rows:
+            break
+        for row in rows:
+            c.execute(
+                "SELECT id, size FROM article_history WHERE article_id=? AND id<? ORDER BY id DESC LIMIT 1",
+                (row['article_id'], row['id'])
+            )
+            parent = c.fetchone()
+            size = len(row['content'].encode("utf-8"))
+            size_delta = size - parent['size'] if parent and parent['size'] is not None else (None if parent else size)
+            c.execute(
+                "UPDATE article_history SET size=?, size_delta=?, content_hash=?, parent_rev_id=? WHERE id=?",
+                (size, size_delta, content_hash(row['content']), parent['id'] if parent else None, row['id'])
+            )
+        conn.commit()
+        last_id = rows[-1]['id']
+        done += len(rows)
+        if progress:
+            progress(done)
+    return done
+
+def iter_article_revisions(repository, article):
+    """Revisões de um artigo em ordem cronológica, lidas direto do cursor.
+
+    Se o conteúdo atual não estiver no fim do histórico (ex.: artigo inicial
+    ou perfis), ele sai como uma revisão extra.
+    """
+    last = None
+    for row in repository.iter_revisions(article['id']):
+        last = row['content']
+        yield {"id": row['id'], "ts": row['ts'], "user": row['user'], "summary": row['summary'], "content": row['content']}
+    if last != article['content']:
+        yield {"id": None, "ts": article['last_edited'], "user": article['last_editor'], "summary": None, "content": article['content']}
+
+def xml_text_element(xml, tag, text, attrs=None):
+    xml.startElement(tag, attrs or {})
+    if text:
+        xml.characters(text)
+    xml.endElement(tag)
+
+def export_xml(repository, out):
+    xml = XMLGenerator(out, encoding="utf-8")
+    xml.startDocument()
+    xml.startElement("mediawiki", {"xmlns": MW_EXPORT_NS, "version": "0.10", "xml:lang": "pt"})
+    xml.startElement("siteinfo", {})
+    xml_text_element(xml, "sitename", wiki_config["APP_TITLE"])
+    xml_text_element(xml, "generator", "AWE")
+    xml.endElement("siteinfo")
+    xml.ignorableWhitespace("\n")
+
+    pages = 0
+    for article in repository.iter_articles():
+        xml.startElement("page", {})
+        xml_text_element(xml, "title", article['slug'])
+        xml_text_element(xml, "ns", "0")
+        xml_text_element(xml, "id", str(article['id']))
+        for rev in iter_article_revisions(repository, article):
+            xml.startElement("revision", {})
+            if rev['id'] is not None:
+                xml_text_element(xml, "id", str(rev['id']))
+            if rev['ts']:
+                xml_text_element(xml, "timestamp", mw_export_timestamp(rev['ts']))
+            xml.startElement("contributor", {})
+            xml_text_element(xml, "username", rev['user'])
+            xml.endElement("contributor")
+            if rev['summary']:
+                xml_text_element(xml, "comment", rev['summary'])
+            xml_text_element(xml, "model", "wikitext")
+            xml_text_element(xml, "format", "text/x-wiki")
+            xml_text_element(xml, "text", rev['content'], {"xml:space": "preserve"})
+            xml.endElement("revision")
+        xml.endElement("page")
+        xml.ignorableWhitespace("\n")
+        pages += 1
+
+    xml.endElement("mediawiki")
+    xml.endDocument()
+    return pages
+
+def export_jsonl(repository, out):
+    pages = 0
+    for article in repository.iter_articles():
+        page = {
+            "slug": article['slug'],
+            "title": article['title'],
+            "revisions": list(iter_article_revisions(repository, article))
+        }
+        out.write(json.dumps(page, ensure_ascii=False).encode("utf-8") + b"\n")
+        pages += 1
+    return pages
+
+def dump_format(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if ".jsonl" in path else "xml"
+
+@app.cli.command("import-wiki")
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(["xml", "jsonl"]), help="Padrão: pela extensão do arquivo.")
+@click.option("--batch-size", default=IMPORT_BATCH_SIZE, show_default=True, help="Revisões por executemany.")
+@click.option("--commit-pages", default=IMPORT_COMMIT_PAGES, show_default=True, help="Páginas por transação.")
+def import_wiki_command(path, fmt, batch_size, commit_pages):
+    """Importa um dump MediaWiki XML ou JSONL com histórico completo."""
+    require_sqlite("import-wiki")
+    init_db()
+    conn = get_db()
+    start = time.monotonic()
+
+    def progress(pages, revs):
+        elapsed = max(time.monotonic() - start, 1e-6)
+        click.echo(f"{pages} páginas, {revs} revisões novas ({pages / elapsed:.0f} páginas/s)")
+
+    with open_dump(path, "rb") as f:
+        if dump_format(path, fmt) == "xml":
+            revisions = iter_mediawiki_revisions(f)
+        else:
+            revisions = iter_jsonl_revisions(f)
+        pages, revs = import_revisions(conn, revisions, batch_size, commit_pages, progress)
+    rebuild_user_stats(conn.cursor())
+    conn.commit()
+    conn.close()
+    progress(pages, revs)
+
+@app.cli.command("backfill-history")
+@click.option("--batch-size", default=BACKFILL_BATCH_SIZE, show_default=True, help="Revisões por transação.")
+def backfill_history_command(batch_size):
+    """Calcula tamanho, delta, hash e revisão pai das revisões antigas."""
+    require_sqlite("backfill-history")
+    init_db()
+    conn = get_db()
+    done = backfill_history(conn, batch_size, lambda n: click.echo(f"{n} revisões atualizadas"))
+    conn.close()
+    click.echo(f"Backfill concluído: {done} revisões.")
+
+@app.cli.command("rebuild-user-stats")
+def rebuild_user_stats_command():
+    """Recalcula os contadores de contribuição de todos os usuários."""
+    require_sqlite("rebuild-user-stats")
+    init_db()
+    conn = get_db()
+    rebuild_user_stats(conn.cursor())
+    conn.commit()
+    conn.close()
+    click.echo("user_stats recalculado.")
+
+@app.cli.command("export-wiki")
+@click.argument("path")
+@click.option("--format", "fmt", type=click.Choice(["xml", "jsonl"]), help="Padrão: pela extensão do arquivo.")
+def export_wiki_command(path, fmt):
+    """Exporta todos os artigos e o histórico em MediaWiki XML ou JSONL."""
+    start = time.monotonic()
+    with open_dump(path, "wb") as out:
+        if dump_format(path, fmt) == "xml":
+            pages = export_xml(repo, out)
+        else:
+            pages = export_jsonl(repo, out)
+    elapsed = max(time.monotonic() - start, 1e-6)
+    click.echo(f"{pages} páginas exportadas ({pages / elapsed:.0f} páginas/s)")
+
+# ---------- ESPELHO ESTÁTICO ----------
+# cópia só-leitura em HTML puro pra servir de hospedagem estática quando a app
+# está sob carga ou em manutenção. /wiki/<slug> vira wiki/<slug>/index.html,
+# então os links que o url_for gera continuam valendo (servir na raiz do domínio).
+MIRROR_MANIFEST = "mirror.json"   # slug -> last_edited e versão das discussões da última exportação
+MIRROR_QUEUE_PER_WORKER = 4       # páginas na fila por processo; limita a memória do stream
+SEARCH_INDEX_TEXT = 500           # caracteres de texto por página no search-index.json
+MARKUP_RE = re.compile(r"<[^>]+>|\[\[|\]\]|\{\{|\}\}|'{2,}|={2,}")
+
+def mirror_page_path(out_dir, slug):
+    parts = slug.split("/")
+    if any(p in ("", ".", "..") for p in parts):
+        return None  # não deixa um slug escrever fora do diretório
+    return os.path.join(out_dir, "wiki", *parts, "index.html")
+
+def write_text_atomic(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def plain_text(content, limit=SEARCH_INDEX_TEXT):
+    return " ".join(MARKUP_RE.sub(" ", content or "").split())[:limit]
+
+def _mirror_worker_init():
+    # o pool do PostgreSQL não sobrevive ao fork; cada processo abre o seu
+    global repo
+    repo = make_repository()
+
+def render_mirror_page(article, out_dir, home_slug):
+    """Renderiza um artigo pelo article.html e grava o arquivo (roda no pool de processos)."""
+    with app.test_request_context("/"):
+        # blocos de cache próprios: o html do espelho não tem links pra rotas da app
+        discussion_version, topics, replies_map = repo.discussions(article['id'], "mirror-discussion")
+        history_version, article_history = repo.history(article['id'], "mirror-history")
+        html = render_template(
+            "article.html",
+            cu=None,
+            mirror=True,
+            title=article['title'],
+            slug=article['slug'],
+            content=article['content'],
+            article_id=article['id'],
+            discussion_version=discussion_version,
+            discussion_topics=topics,
+            discussion_replies=replies_map,
+            history_version=history_version,
+            article_history=article_history,
+            last_edited=article['last_edited']
+        )
+    write_text_atomic(mirror_page_path(out_dir, article['slug']), html)
+    if article['slug'] == home_slug:
+        write_text_atomic(os.path.join(out_dir, "index.html"), html)
+    return article['slug']
+
+def export_static(out_dir, base_url="", workers=None, full=False, progress=None):
+    """Exporta o espelho estático, com sitemap.xml e search-index.json.
+
+    Os artigos vêm de um cursor em stream e só os que mudaram de last_edited
+    ou ganharam tópico/resposta desde a exportação anterior (ou sem arquivo)
+    vão pro pool de processos; a
+    fila é limitada, então a memória não cresce com o tamanho da wiki. Páginas
+    de artigos que sumiram (apagados ou movidos) são removidas. Devolve
+    (renderizados, pulados, removidos).
+    """
+    manifest_path = os.path.join(out_dir, MIRROR_MANIFEST)
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = {}
+    current = {}
+    home_slug = f"{wiki_config['APP_TITLE']}:PP"
+    workers = workers or os.cpu_count() or 1
+    rendered = skipped = 0
+    pending = set()
+
+    os.makedirs(out_dir, exist_ok=True)
+    shutil.copytree("static", os.path.join(out_dir, "static"), dirs_exist_ok=True)
+    sitemap_path = os.path.join(out_dir, "sitemap.xml")
+    index_path = os.path.join(out_dir, "search-index.json")
+
+    def collect(done):
+        nonlocal rendered
+        for future in done:
+            future.result()
+            rendered += 1
+            if progress and rendered % 100 == 0:
+                progress(rendered, skipped)
+
+    try:
+        with ProcessPoolExecutor(workers, initializer=_mirror_worker_init) as pool, \
+                open(sitemap_path + ".tmp", "w", encoding="utf-8") as sitemap, \
+                open(index_path + ".tmp", "w", encoding="utf-8") as index, \
+                app.test_request_context("/"):
+            sitemap.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            sitemap.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n')
+            index.write("[")
+            for article in repo.iter_articles_with_discussion_version():
+                slug = article['slug']
+                path = mirror_page_path(out_dir, slug)
+                if path is None:
+                    continue
+                url = url_for('goto', slug=slug)
+                lastmod = f"<lastmod>{escape(article['last_edited'][:10])}</lastmod>" if article['last_edited'] else ""
+                sitemap.write(f"  <url><loc>{escape(base_url.rstrip('/') + url)}</loc>{lastmod}</url>\n")
+                index.write(("," if current else "") + "\n" + json.dumps(
+                    {"slug": slug, "title": article['title'], "url": url, "text": plain_text(article['content'])},
+                    ensure_ascii=False
+                ))
+                # a página mostra as discussões, então tópico novo também pede re-render
+                current[slug] = {"last_edited": article['last_edited'], "discussion": article['discussion_version']}
+
+                if not full and previous.get(slug) == current[slug] and os.path.exists(path):
+                    skipped += 1
+                    continue
+                pending.add(pool.submit(render_mirror_page, dict(article), out_dir, home_slug))
+                if len(pending) >= workers * MIRROR_QUEUE_PER_WORKER:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            collect(wait(pending).done)
+            sitemap.write("</urlset>\n")
+            index.write("\n]\n")
+        os.replace(sitemap_path + ".tmp", sitemap_path)
+        os.replace(index_path + ".tmp", index_path)
+    finally:
+        # se um worker levantou exceção, não deixa os .tmp pela metade no espelho
+        for tmp_path in (sitemap_path + ".tmp", index_path + ".tmp"):
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    removed = 0
+    for slug in previous.keys() - current.keys():
+        path = mirror_page_path(out_dir, slug)
+        if path and os.path.exists(path):
+            os.remove(path)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass  # ainda tem subpáginas
+            removed += 1
+
+    write_text_atomic(manifest_path, json.dumps(current, ensure_ascii=False))
+    return rendered, skipped, removed
+
+@app.cli.command("export-static")
+@click.argument("out_dir")
+@click.option("--base-url", default="", help="Endereço público do espelho, usado no sitemap (ex.: https://wiki.exemplo.org).")
+@click.option("--workers", type=int, help="Processos de renderização. Padrão: número de CPUs.")
+@click.option("--full", is_flag=True, help="Renderiza tudo de novo, ignorando o manifesto.")
+def export_static_command(out_dir, base_url, workers, full):
+    """Gera um espelho estático só-leitura da wiki (incremental pelo last_edited)."""
+    start = time.monotonic()
+    rendered, skipped, removed = export_static(
+        out_dir, base_url, workers, full,
+        lambda done, kept: click.echo(f"{done} páginas renderizadas, {kept} sem mudança")
+    )
+    elapsed = max(time.monotonic() - start, 1e-6)
+    click.echo(f"{rendered} renderizadas, {skipped} sem mudança, {removed} removidas "
+               f"({rendered / elapsed:.0f} páginas/s)")
+
 # ---------- START ----------
 if __name__ == "__main__":
-    init_db()
+    repo.init_schema()
     app.run(ssl_context=('cert.pem', 'key.pem'), debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
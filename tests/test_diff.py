@@ -0,0 +1,107 @@
+import difflib
+
+import pytest
+
+import app as awe
+
+
+def apply_opcodes(a, b, opcodes):
+    # reconstrói b a partir de a pelos opcodes, como o difflib
+    out = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            assert a[i1:i2] == b[j1:j2]
+            out.extend(a[i1:i2])
+        else:
+            out.extend(b[j1:j2])
+    return out
+
+
+@pytest.mark.parametrize("a, b", [
+    ("", ""),
+    ("abc", ""),
+    ("", "abc"),
+    ("abcdef", "abcdef"),
+    ("abcdef", "abXdef"),
+    ("abcabcabc", "cbacbacba"),
+    ("aaaaab", "baaaaa"),
+])
+def test_diff_sequences_rebuilds_target(a, b):
+    opcodes = awe.diff_sequences(list(a), list(b))
+    assert apply_opcodes(list(a), list(b), opcodes) == list(b)
+    # cobre as duas sequências inteiras, sem buraco nem sobreposição
+    assert [op[1] for op in opcodes[1:]] == [op[2] for op in opcodes[:-1]]
+    assert [op[3] for op in opcodes[1:]] == [op[4] for op in opcodes[:-1]]
+
+
+def test_diff_sequences_anchors_on_unique_lines():
+    a = ["}", "def f():", "    return 1", "}", "def g():", "    return 2", "}"]
+    b = ["}", "def g():", "    return 2", "}", "def f():", "    return 1", "}"]
+    opcodes = awe.diff_sequences(a, b)
+    equal = sum(i2 - i1 for tag, i1, i2, _, _ in opcodes if tag == "equal")
+    assert equal >= 4
+    assert apply_opcodes(a, b, opcodes) == b
+
+
+def test_diff_sequences_without_anchors_matches_difflib():
+    a = list("abababab")
+    b = list("babababa")
+    ours = sum(i2 - i1 for tag, i1, i2, _, _ in awe.diff_sequences(a, b) if tag == "equal")
+    theirs = sum(size for _, _, size in difflib.SequenceMatcher(None, a, b, autojunk=False).get_matching_blocks())
+    assert ours == theirs
+
+
+def test_diff_sequences_gives_up_on_huge_regions(monkeypatch):
+    monkeypatch.setattr(awe, "DIFF_FALLBACK_LIMIT", 4)
+    assert awe.diff_sequences(list("abab"), list("baba")) == [("replace", 0, 4, 0, 4)]
+
+
+def test_render_diff_counts_and_marks_words():
+    rows, added, removed = awe.render_diff("um\ndois\ntrês", "um\ndois quatro\ntrês\ncinco")
+    assert (added, removed) == (2, 1)
+    assert [row["kind"] for row in rows] == ["equal", "del", "ins", "equal", "ins"]
+    changed = next(row for row in rows if row["kind"] == "ins" and row["new"] == 2)
+    assert "<ins> quatro</ins>" in changed["html"]
+
+
+def test_render_diff_escapes_html():
+    rows, _, _ = awe.render_diff("<b>a</b>", "<script>x</script>")
+    html = "".join(str(row["html"]) for row in rows)
+    assert "<script>" not in html and "<b>" not in html
+    assert "&lt;<ins>script</ins>&gt;" in html
+
+
+def test_render_diff_collapses_context():
+    old = "\n".join(str(i) for i in range(20))
+    new = old.replace("10", "dez")
+    rows, added, removed = awe.render_diff(old, new, context=2)
+    assert (added, removed) == (1, 1)
+    kinds = [row["kind"] for row in rows]
+    assert kinds == ["skip", "equal", "equal", "del", "ins", "equal", "equal", "skip"]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setitem(awe.wiki_config.data, "DB_FILE", str(tmp_path / "wiki.db"))
+    monkeypatch.setattr(awe, "repo", awe.SQLiteRepository())
+    awe.repo.init_schema()
+    return awe.app.test_client()
+
+
+def test_diff_route_rejects_other_articles_revisions(client):
+    a = awe.repo.ensure_article("A", "A", "")
+    b = awe.repo.ensure_article("B", "B", "")
+    awe.repo.update_article(a, "um", "ana")
+    awe.repo.update_article(a, "dois", "ana")
+    awe.repo.update_article(b, "outro", "ana")
+    new_id, old_id = [row["id"] for row in awe.repo.revision_list(a["id"])]
+    other_id = awe.repo.last_revision(b["id"])["id"]
+
+    response = client.get(f"/history/A/diff/{old_id}/{new_id}")
+    assert response.status_code == 200
+    assert b"dois" in response.data
+
+    for url in (f"/history/A/diff/{old_id}/{other_id}", f"/history/A/diff/999/{new_id}"):
+        response = client.get(url)
+        assert response.status_code == 302
+        assert response.headers["Location"] == "/wiki/A"
@@ -0,0 +1,73 @@
+import io
+import json
+
+import pytest
+
+import app as awe
+
+
+def dump(pages):
+    lines = [json.dumps({"slug": slug, "title": slug, "revisions": revs}) for slug, revs in pages]
+    return io.BytesIO("\n".join(lines).encode("utf-8"))
+
+
+PAGES = [
+    ("A", [
+        {"ts": "2024-01-01T10:00:00", "user": "ana", "content": "um"},
+        {"ts": "2024-01-02T10:00:00", "user": "bia", "content": "um dois"},
+    ]),
+    ("B", [
+        {"ts": "2024-01-03T10:00:00", "user": "ana", "content": "b"},
+        {"ts": "2024-01-04T10:00:00", "user": "ana", "content": "bb"},
+    ]),
+]
+
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.setitem(awe.wiki_config.data, "DB_FILE", str(tmp_path / "wiki.db"))
+    awe.init_db()
+    conn = awe.get_db()
+    yield conn
+    conn.close()
+
+
+def imported(conn):
+    return conn.execute(
+        "SELECT slug, ts, size_delta, parent_rev_id FROM article_history WHERE slug IN ('A', 'B') ORDER BY id"
+    ).fetchall()
+
+
+def test_import_twice_adds_nothing(conn):
+    revisions = awe.iter_jsonl_revisions(dump(PAGES))
+    assert awe.import_revisions(conn, revisions) == (2, 4)
+    first = [tuple(row) for row in imported(conn)]
+
+    assert awe.import_revisions(conn, awe.iter_jsonl_revisions(dump(PAGES))) == (2, 0)
+    assert [tuple(row) for row in imported(conn)] == first
+    assert conn.execute("SELECT content FROM articles WHERE slug='A'").fetchone()[0] == "um dois"
+
+
+def test_import_resumes_after_failure_with_parents_linked(conn):
+    def crashing():
+        for rev in awe.iter_jsonl_revisions(dump(PAGES)):
+            if rev["ts"] == "2024-01-04T10:00:00":
+                raise RuntimeError("dump cortado")
+            yield rev
+
+    with pytest.raises(RuntimeError):
+        awe.import_revisions(conn, crashing(), commit_pages=1)
+    conn.rollback()
+    # a página A já tinha sido commitada, com o pai ligado
+    rows = imported(conn)
+    assert [row["slug"] for row in rows] == ["A", "A"]
+    assert rows[0]["parent_rev_id"] is None
+    assert rows[1]["parent_rev_id"] is not None
+
+    assert awe.import_revisions(conn, awe.iter_jsonl_revisions(dump(PAGES)), commit_pages=1) == (2, 2)
+    rows = imported(conn)
+    assert [row["slug"] for row in rows] == ["A", "A", "B", "B"]
+    assert [row["size_delta"] for row in rows] == [2, 5, 1, 1]
+    assert rows[3]["parent_rev_id"] == conn.execute(
+        "SELECT id FROM article_history WHERE slug='B' ORDER BY id LIMIT 1"
+    ).fetchone()[0]
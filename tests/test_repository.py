@@ -0,0 +1,186 @@
+import os
+
+import pytest
+
+import app as awe
+
+PG_TABLES = ("user_stats", "discussions", "article_history", "articles", "users")
+
+
+def sqlite_repository(tmp_path, monkeypatch):
+    monkeypatch.setitem(awe.wiki_config.data, "DB_FILE", str(tmp_path / "wiki.db"))
+    repository = awe.SQLiteRepository()
+    repository.init_schema()
+    return repository
+
+
+def postgres_repository(tmp_path, monkeypatch):
+    url = os.environ.get("DATABASE_URL")
+    if not url:
+        pytest.skip("DATABASE_URL não definida")
+    if awe.psycopg is None:
+        pytest.skip("psycopg não instalado")
+    # banco de teste: começa sempre do zero
+    with awe.psycopg.connect(url, autocommit=True) as conn:
+        for table in PG_TABLES:
+            conn.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+    repository = awe.PostgresRepository(url, min_size=1, max_size=2)
+    repository.init_schema()
+    return repository
+
+
+def head(repo, article_id):
+    # last_revision só traz id, size e hash; aqui queremos a linha inteira
+    return repo.revision(repo.last_revision(article_id)["id"])
+
+
+@pytest.fixture(params=[sqlite_repository, postgres_repository], ids=["sqlite", "postgres"])
+def repo(request, tmp_path, monkeypatch):
+    repository = request.param(tmp_path, monkeypatch)
+    yield repository
+    if isinstance(repository, awe.PostgresRepository):
+        repository.pool.close()
+
+
+def test_seed(repo):
+    assert repo.get_user("admin")["is_admin"] == 1
+    home = f"{awe.wiki_config['APP_TITLE']}:PP"
+    assert repo.get_article(home)["last_editor"] == "admin"
+
+
+def test_ensure_and_get_article(repo):
+    article = repo.ensure_article("Teste", "Teste", "corpo", editor="ana")
+    assert article["content"] == "corpo"
+    # já existe: devolve o mesmo artigo sem sobrescrever
+    again = repo.ensure_article("Teste", "Teste", "outro corpo")
+    assert again["id"] == article["id"]
+    assert again["content"] == "corpo"
+    assert repo.get_article_by_id(article["id"])["slug"] == "Teste"
+    assert repo.find_article("est")["id"] == article["id"]
+    assert repo.get_article("Inexistente") is None
+
+
+def test_update_article_records_history(repo):
+    article = repo.ensure_article("Teste", "Teste", "")
+    repo.update_article(article, "um", "ana")
+    repo.update_article(repo.get_article("Teste"), "um dois", "bia")
+
+    assert repo.get_article("Teste")["content"] == "um dois"
+    last = head(repo, article["id"])
+    first = repo.revision(last["parent_rev_id"])
+    assert (first["content"], first["user"], first["size"]) == ("um", "ana", 2)
+    assert (last["user"], last["size"], last["size_delta"]) == ("bia", 7, 5)
+    assert last["content_hash"] == awe.content_hash("um dois")
+
+    version, rows = repo.history(article["id"])
+    assert version == (last["id"], last["ts"])
+    assert [row["user"] for row in rows] == ["bia", "ana"]
+    assert [row["id"] for row in repo.iter_revisions(article["id"])] == [first["id"], last["id"]]
+
+
+def test_update_article_marks_revert(repo):
+    article = repo.ensure_article("Teste", "Teste", "")
+    repo.update_article(article, "a", "ana")
+    repo.update_article(article, "b", "bia")
+    repo.update_article(article, "a", "ana")
+    first = repo.revision(repo.revision(head(repo, article["id"])["parent_rev_id"])["parent_rev_id"])
+    assert head(repo, article["id"])["summary"] == f"Revertido para a versão {first['id']}"
+
+
+def test_move_article(repo):
+    article = repo.ensure_article("Velho", "Velho", "texto")
+    repo.ensure_article("Ocupado", "Ocupado", "x")
+    repo.update_article(article, "texto", "ana")
+
+    with pytest.raises(awe.DuplicateError):
+        repo.move_article(repo.get_article("Velho"), "Ocupado", "ana")
+    assert repo.get_article("Velho") is not None
+
+    repo.move_article(repo.get_article("Velho"), "Novo", "bia")
+    assert repo.get_article("Velho") is None
+    moved = repo.get_article("Novo")
+    assert moved["id"] == article["id"]
+    last = head(repo, article["id"])
+    assert last["summary"] == "Moveu de Velho para Novo"
+    assert last["size_delta"] == 0
+    assert len(repo.revision_list(article["id"])) == 2
+
+
+def test_contributions_keyset(repo):
+    article = repo.ensure_article("Teste", "Teste", "")
+    for i in range(5):
+        repo.update_article(article, "x" * (i + 1), "ana")
+    repo.update_article(article, "outro", "bia")
+
+    first_page = repo.contributions("ana", limit=3)
+    assert len(first_page) == 3
+    second_page = repo.contributions("ana", before=first_page[-1]["id"], limit=3)
+    assert len(second_page) == 2
+    ids = [row["id"] for row in first_page + second_page]
+    assert ids == sorted(ids, reverse=True)
+    assert all(row["slug"] == "Teste" and row["user"] == "ana" for row in first_page + second_page)
+
+    stats = repo.user_stats("ana")
+    assert (stats["edit_count"], stats["pages_touched"]) == (5, 1)
+    assert [row["user"] for row in repo.recent_changes(limit=1)] == ["bia"]
+
+
+def test_discussions(repo):
+    article = repo.ensure_article("Teste", "Teste", "")
+    assert repo.discussions(article["id"]) == ("", [], {})
+
+    repo.add_discussion(article["id"], "ana", "primeira", title="Tópico")
+    (topic,) = repo.discussions(article["id"])[1]
+    assert repo.get_topic(article["id"], topic["id"])["user"] == "ana"
+    assert repo.get_topic(article["id"] + 1000, topic["id"]) is None
+
+    repo.add_discussion(article["id"], "bia", "resposta", parent_id=topic["id"], reply_to="ana")
+    version, topics, replies = repo.discussions(article["id"])
+    assert [t["topic_title"] for t in topics] == ["Tópico"]
+    assert [r["comment_text"] for r in replies[topic["id"]]] == ["resposta"]
+    assert version == replies[topic["id"]][0]["ts"]
+
+
+def test_users(repo):
+    repo.create_user("ana", "hash1")
+    with pytest.raises(awe.DuplicateError):
+        repo.create_user("ana", "hash2")
+    user = repo.get_user("ana")
+    assert user["password"] == "hash1"
+    repo.set_password(user["id"], "hash3")
+    assert repo.get_user("ana")["password"] == "hash3"
+    assert repo.get_user("ninguem") is None
+
+
+def test_rollback_targets(repo):
+    edited = repo.ensure_article("Editado", "Editado", "")
+    created = repo.ensure_article("Criado", "Criado", "")
+    fixed = repo.ensure_article("Corrigido", "Corrigido", "")
+    repo.update_article(edited, "bom", "ana")
+    repo.update_article(edited, "vandalismo", "troll")
+    repo.update_article(created, "spam", "troll")
+    repo.update_article(fixed, "ruim", "troll")
+    repo.update_article(fixed, "consertado", "ana")
+    good = repo.revision(head(repo, edited["id"])["parent_rev_id"])
+
+    targets = {row["slug"]: row["good_id"] for row in repo.rollback_targets("troll")}
+    assert targets == {"Editado": good["id"], "Criado": None}
+
+    assert repo.rollback_user_edits("troll", "admin") == (1, 1)
+    assert repo.get_article("Editado")["content"] == "bom"
+    assert repo.get_article("Corrigido")["content"] == "consertado"
+    assert head(repo, edited["id"])["user"] == "admin"
+    # a página criada pelo troll não tem versão boa e continua na lista
+    assert [row["slug"] for row in repo.rollback_targets("troll")] == ["Criado"]
+
+
+def test_scan(repo):
+    with repo.transaction() as c:
+        c.executemany(
+            "INSERT INTO articles (slug, title, content) VALUES (?, ?, ?)",
+            [(f"Artigo {i:04d}", f"Artigo {i:04d}", "") for i in range(awe.SCAN_BATCH_SIZE + 5)]
+        )
+    rows = list(repo.scan("SELECT slug FROM articles WHERE slug LIKE ? ORDER BY slug", ("Artigo %",)))
+    assert len(rows) == awe.SCAN_BATCH_SIZE + 5
+    assert rows[0]["slug"] == "Artigo 0000"
+    assert sum(1 for _ in repo.iter_articles()) == awe.SCAN_BATCH_SIZE + 6